@@ -1,14 +1,28 @@
 import win32com.client
+import asyncio
+import aiofiles
+import httpx
+import msal
 import sqlite3
+import functools
 import gradio as gr
 import logging
 import os
-import subprocess
+import shutil
 import sys
-import matplotlib.pyplot as plt
+import threading
+import hashlib
+import json
+import math
+from collections import defaultdict
+from xml.sax.saxutils import escape
+from insert_data_from_csv import insert_data_from_csv
 
 root_folder = "C:\\Users\\psharmak\\OneDrive - Amgen\\psharmak\\agents\\CRO_file_analysis\\"
 files_folder = os.path.join(root_folder, "files")
+# Rendered pie charts live apart from the downloaded attachments and are
+# discarded whenever fresh data is loaded
+charts_folder = os.path.join(files_folder, "charts")
 
 ATTACHMENT_SUBJECTS = {
     "ExtCTMS: All CRO Partner - CTMS Report for study and site Information": "ctms_report.csv",
@@ -19,6 +33,16 @@ ATTACHMENT_SUBJECTS = {
     "The SAP site report with ExtCTMS sites": "ctms_devods_sap_cmp_report.csv",
 }
 
+OUTPUT_VARIABLE_MAP = {
+    "Site in DevODS": "DEVODS_SITE_EXISTS",
+    "Data in DevODS": "DEVODS_DATA_COMPLETE",
+    "Site in SAP": "SAP_SITE_CREATED",
+    "Reg. Block": "SAP_REGULATORY_BLOCK"
+}
+
+PIE_LABELS = ("Yes", "No", "Absent")
+PIE_COLORS = ("#1f77b4", "#ff7f0e", "#2ca02c")
+
 class OutlookConnector:
     def connect(self):
         print("Connecting to Outlook...")
@@ -33,10 +57,47 @@ class OutlookConnector:
             return None
 
 class AttachmentExtractor:
+    # Bytes from the start of a saved attachment that feed its signature
+    SIGNATURE_BYTES = 65536
+
     def __init__(self, connector, save_path, subjects):
         self.connector = connector
         self.save_path = save_path
         self.subjects = subjects
+        self.signatures_path = os.path.join(save_path, ".sig.json")
+
+    def _load_signatures(self):
+        try:
+            with open(self.signatures_path, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"Could not read attachment signatures '{self.signatures_path}': {e}")
+            return {}
+
+    def _save_signatures(self, signatures):
+        # Write to a temp file and swap it in so a crash never leaves half a file
+        tmp_path = self.signatures_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(signatures, file, indent=4)
+        os.replace(tmp_path, self.signatures_path)
+
+    def _file_signature(self, path):
+        """blake2b of the file's first SIGNATURE_BYTES plus its mtime."""
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as file:
+            digest.update(file.read(self.SIGNATURE_BYTES))
+        digest.update(str(os.stat(path).st_mtime_ns).encode("ascii"))
+        return digest.hexdigest()
+
+    def _is_unchanged(self, record, attachment_size, received, save_path):
+        if not record or record.get("attachment_size") != attachment_size or record.get("received") != received:
+            return False
+        try:
+            return self._file_signature(save_path) == record.get("signature")
+        except OSError:
+            return False
 
     def extract(self):
         print(f"Extracting attachments")
@@ -50,30 +111,188 @@ class AttachmentExtractor:
                 logging.error("Could not find the ExtCTMS sub-folder, exiting.")
                 sys.exit(1)
             else:
-                messages = extctms_folder.Items
-                message = messages.GetFirst()
-                while message:
-                    subject = message.Subject
-                    if subject in self.subjects:
-                        for attachment in message.Attachments:
-                            save_path = os.path.join(self.save_path, attachment.FileName)
-                            # Check if the file already exists and has the same size
-                            if os.path.exists(save_path) and os.path.getsize(save_path) == attachment.Size:
-                                logging.info(f"Attachment '{attachment.FileName}' already exists with the same size at '{save_path}', skipping.")
-                                print(f"Attachment '{attachment.FileName}' already exists with the same size at '{save_path}', skipping.")
-                            else:
-                                action = "Overwriting" if os.path.exists(save_path) else "Saving"
-                                logging.info(f"{action} attachment '{attachment.FileName}' from email with subject '{subject}' to '{save_path}'")
-                                print(f"{action} attachment '{attachment.FileName}' from email with subject '{subject}' to '{save_path}'")
-                                attachment.SaveAsFile(save_path)
-                    message = messages.GetNext()
+                # Let the store filter by subject and hand back the newest match first;
+                # only that message's attachments can end up on disk
+                candidates = {}
+                for subject in self.subjects:
+                    subject_filter = subject.replace("'", "''")
+                    messages = extctms_folder.Items.Restrict(f"[Subject] = '{subject_filter}'")
+                    messages.Sort("[ReceivedTime]", True)
+                    message = messages.GetFirst()
+                    if not message:
+                        continue
+                    received = message.ReceivedTime.isoformat()
+                    for attachment in message.Attachments:
+                        save_path = os.path.join(self.save_path, attachment.FileName)
+                        if save_path not in candidates or candidates[save_path][3] < received:
+                            candidates[save_path] = (attachment, attachment.FileName, attachment.Size, received, subject)
+
+                # Outlook's Size includes MIME overhead, so compare against what was
+                # recorded at the last save instead of the on-disk size
+                signatures = self._load_signatures()
+                pending = {}
+                for save_path, (attachment, file_name, attachment_size, received, subject) in candidates.items():
+                    if self._is_unchanged(signatures.get(file_name), attachment_size, received, save_path):
+                        logging.info(f"Attachment '{file_name}' is unchanged at '{save_path}', skipping.")
+                        print(f"Attachment '{file_name}' is unchanged at '{save_path}', skipping.")
+                    else:
+                        action = "Overwriting" if os.path.exists(save_path) else "Saving"
+                        logging.info(f"{action} attachment '{file_name}' from email with subject '{subject}' to '{save_path}'")
+                        print(f"{action} attachment '{file_name}' from email with subject '{subject}' to '{save_path}'")
+                        pending[save_path] = (attachment, file_name, attachment_size, received)
+
+                # Outlook runs every object-model call on its own thread, so the
+                # saves stay on this one
+                for save_path, (attachment, file_name, attachment_size, received) in pending.items():
+                    try:
+                        attachment.SaveAsFile(save_path)
+                        signatures[file_name] = {
+                            "attachment_size": attachment_size,
+                            "received": received,
+                            "signature": self._file_signature(save_path),
+                        }
+                        logging.info(f"Saved attachment to '{save_path}'")
+                    except Exception as e:
+                        logging.error(f"Failed to save attachment to '{save_path}': {e}")
+
+                if pending:
+                    self._save_signatures(signatures)
         except Exception as e:
             logging.error(f"Error in extract_attachments: {e}")
 
+class GraphConnector:
+    """Authenticates against Microsoft Graph with the signed-in user's account."""
+    SCOPES = ["Mail.Read"]
+
+    def __init__(self, client_id, tenant_id):
+        self.app = msal.PublicClientApplication(client_id, authority=f"https://login.microsoftonline.com/{tenant_id}")
+
+    def connect(self):
+        print("Connecting to Microsoft Graph...")
+        try:
+            accounts = self.app.get_accounts()
+            result = self.app.acquire_token_silent(self.SCOPES, account=accounts[0]) if accounts else None
+            if not result:
+                result = self.app.acquire_token_interactive(self.SCOPES)
+            if "access_token" not in result:
+                raise RuntimeError(result.get("error_description", "no access token returned"))
+            logging.info("Successfully connected to Microsoft Graph.")
+            return result["access_token"]
+        except Exception as e:
+            logging.error(f"Failed to connect to Microsoft Graph: {e}")
+            print(f"Failed to connect to Microsoft Graph: {e}")
+            return None
+
+class GraphAttachmentExtractor(AttachmentExtractor):
+    """Downloads the ExtCTMS attachments over HTTPS instead of Outlook COM.
+
+    One query per subject returns the newest matching message, and every
+    attachment is then fetched concurrently over a single shared client.
+    """
+    GRAPH_URL = "https://graph.microsoft.com/v1.0"
+
+    def __init__(self, connector, save_path, subjects, max_workers=4):
+        super().__init__(connector, save_path, subjects)
+        self.max_workers = max_workers
+
+    def extract(self):
+        print("Extracting attachments")
+        try:
+            token = self.connector.connect()
+            if token is None:
+                logging.error("Could not connect to Microsoft Graph, exiting.")
+                sys.exit(1)
+            asyncio.run(self._extract(token))
+        except Exception as e:
+            logging.error(f"Error in extract_attachments: {e}")
+
+    async def _extract(self, token):
+        headers = {"Authorization": f"Bearer {token}"}
+        limits = httpx.Limits(max_connections=self.max_workers * 2)
+        async with httpx.AsyncClient(base_url=self.GRAPH_URL, headers=headers, limits=limits, timeout=60) as client:
+            response = await client.get(
+                "/me/mailFolders/inbox/childFolders",
+                params={"$filter": "displayName eq 'ExtCTMS'", "$select": "id"},
+            )
+            response.raise_for_status()
+            folders = response.json().get("value", [])
+            if not folders:
+                logging.error("Could not find the ExtCTMS sub-folder, exiting.")
+                sys.exit(1)
+            folder_id = folders[0]["id"]
+
+            messages = await asyncio.gather(*[self._newest_message(client, folder_id, subject) for subject in self.subjects])
+
+            candidates = {}
+            for subject, message in zip(self.subjects, messages):
+                if not message:
+                    continue
+                for attachment in message.get("attachments", []):
+                    save_path = os.path.join(self.save_path, attachment["name"])
+                    if save_path not in candidates or candidates[save_path][3] < message["receivedDateTime"]:
+                        candidates[save_path] = (message["id"], attachment, attachment["size"], message["receivedDateTime"], subject)
+
+            signatures = self._load_signatures()
+            pending = []
+            for save_path, (message_id, attachment, attachment_size, received, subject) in candidates.items():
+                file_name = attachment["name"]
+                if self._is_unchanged(signatures.get(file_name), attachment_size, received, save_path):
+                    logging.info(f"Attachment '{file_name}' is unchanged at '{save_path}', skipping.")
+                    print(f"Attachment '{file_name}' is unchanged at '{save_path}', skipping.")
+                else:
+                    action = "Overwriting" if os.path.exists(save_path) else "Saving"
+                    logging.info(f"{action} attachment '{file_name}' from email with subject '{subject}' to '{save_path}'")
+                    print(f"{action} attachment '{file_name}' from email with subject '{subject}' to '{save_path}'")
+                    pending.append((save_path, message_id, attachment["id"], file_name, attachment_size, received))
+
+            results = await asyncio.gather(
+                *[self._download(client, message_id, attachment_id, save_path) for save_path, message_id, attachment_id, *_ in pending],
+                return_exceptions=True,
+            )
+            for (save_path, _, _, file_name, attachment_size, received), result in zip(pending, results):
+                if isinstance(result, Exception):
+                    logging.error(f"Failed to save attachment to '{save_path}': {result}")
+                    continue
+                signatures[file_name] = {
+                    "attachment_size": attachment_size,
+                    "received": received,
+                    "signature": self._file_signature(save_path),
+                }
+                logging.info(f"Saved attachment to '{save_path}'")
+
+            if pending:
+                self._save_signatures(signatures)
+
+    async def _newest_message(self, client, folder_id, subject):
+        subject_filter = subject.replace("'", "''")
+        # Graph requires $orderby properties to appear first in $filter
+        response = await client.get(
+            f"/me/mailFolders/{folder_id}/messages",
+            params={
+                "$filter": f"receivedDateTime ge 1900-01-01T00:00:00Z and subject eq '{subject_filter}'",
+                "$orderby": "receivedDateTime desc",
+                "$top": "1",
+                "$select": "id,receivedDateTime",
+                "$expand": "attachments($select=id,name,size)",
+            },
+        )
+        response.raise_for_status()
+        messages = response.json().get("value", [])
+        return messages[0] if messages else None
+
+    async def _download(self, client, message_id, attachment_id, save_path):
+        async with client.stream("GET", f"/me/messages/{message_id}/attachments/{attachment_id}/$value") as response:
+            response.raise_for_status()
+            async with aiofiles.open(save_path, "wb") as file:
+                async for chunk in response.aiter_bytes(1 << 16):
+                    await file.write(chunk)
+
 class DataInserter:
-    def __init__(self, root_folder, files_folder):
+    def __init__(self, root_folder, files_folder, db_accessor=None, charts_folder=None):
         self.root_folder = root_folder
         self.files_folder = files_folder
+        self.db_accessor = db_accessor
+        self.charts_folder = charts_folder
 
     def check_and_execute(self):
         ctms_devods_sap_cmp_report_path = os.path.join(self.files_folder, "ctms_devods_sap_cmp_report.csv")
@@ -83,7 +302,20 @@ class DataInserter:
 
         if ctms_devods_sap_cmp_report_exists and ctms_report_exists:
             print("Both files found. Inserting data from CSV files.")
-            subprocess.run(["python", os.path.join(self.root_folder, "insert_data_from_csv.py")])
+            try:
+                insert_data_from_csv()
+            except Exception as e:
+                logging.error(f"Error in insert_data_from_csv: {e}")
+                print(f"Error inserting data from CSV files: {e}")
+                return
+            if self.db_accessor is not None:
+                # Fresh data invalidates any memoized dashboard aggregates and
+                # the preloaded dropdown hierarchy
+                self.db_accessor.get_dashboard_all.cache_clear()
+                self.db_accessor.load_hierarchy()
+            if self.charts_folder is not None:
+                # Charts rendered from the old data will never be requested again
+                shutil.rmtree(self.charts_folder, ignore_errors=True)
         else:
             print("One or both files are missing. Skipping insert_data_from_csv.py")
             return
@@ -91,87 +323,100 @@ class DataInserter:
 class DatabaseAccessor:
     def __init__(self, db_path):
         self.db_path = db_path
+        # One long-lived connection shared by all Gradio callbacks; callbacks run
+        # on worker threads, so every statement is serialized through the lock.
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.executescript("""
+            PRAGMA journal_mode=WAL;
+            PRAGMA synchronous=NORMAL;
+            PRAGMA temp_store=MEMORY;
+            PRAGMA cache_size=-65536;
+            PRAGMA mmap_size=268435456;
+        """)
+        self._lock = threading.Lock()
+        # Dashboard aggregates are memoized per (vendor, study, site);
+        # DataInserter clears the cache after a successful reload.
+        self.get_dashboard_all = functools.lru_cache(maxsize=512)(self._query_dashboard_all)
+        # Yes/No/absent counts for every dashboard column in a single pass over
+        # CTMS_REPORT. Only whitelisted columns are interpolated into the SQL.
+        self._dash_columns = tuple(OUTPUT_VARIABLE_MAP.values())
+        dash_select = "SELECT " + ", ".join(
+            f"SUM(CASE WHEN {column} = 'Yes' THEN 1 ELSE 0 END), "
+            f"SUM(CASE WHEN {column} = 'No' THEN 1 ELSE 0 END), "
+            f"SUM(CASE WHEN {column} IS NULL THEN 1 ELSE 0 END)"
+            for column in self._dash_columns
+        ) + " FROM CTMS_REPORT WHERE 1=1"
+        # One statement per combination of vendor/study/site filters, indexed by
+        # a bitmask (vendor=4, study=2, site=1)
+        self._dash_sql = [
+            dash_select
+            + (" AND VENDOR_NAME = ?" if mask & 4 else "")
+            + (" AND STUDY_NUMBER = ?" if mask & 2 else "")
+            + (" AND SITE_NUMBER_WITHIN_STUDY = ?" if mask & 1 else "")
+            for mask in range(8)
+        ]
+        self.hierarchy = {}
+        self.load_hierarchy()
+
+    def load_hierarchy(self):
+        """Preloads {vendor: {study: [sites]}} so dropdown cascades skip SQLite."""
+        hierarchy = defaultdict(lambda: defaultdict(list))
+        with self._lock:
+            # Every study is listed; only sites whose block was removed are left out
+            cursor = self._conn.execute("""
+                SELECT DISTINCT VENDOR_NAME, STUDY_NUMBER, SITE_NUMBER_WITHIN_STUDY,
+                       IFNULL(SAP_REGULATORY_BLOCK, '') != 'Block Removed'
+                FROM CTMS_REPORT
+            """)
+            for vendor_name, study_number, site_number, site_listed in cursor:
+                sites = hierarchy[vendor_name][study_number]
+                if site_listed:
+                    sites.append(site_number)
+        # Swap in plain dicts so lookups for unknown keys never insert entries
+        self.hierarchy = {vendor_name: dict(studies) for vendor_name, studies in hierarchy.items()}
 
     def get_vendor_names(self):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT DISTINCT VENDOR_NAME FROM CTMS_REPORT")
-        vendor_names = [row[0] for row in cursor.fetchall()]
-        conn.close()
+        with self._lock:
+            cursor = self._conn.execute("SELECT DISTINCT VENDOR_NAME FROM CTMS_REPORT")
+            vendor_names = [row[0] for row in cursor.fetchall()]
         return vendor_names
 
-    def get_study_numbers(self, vendor_name):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT DISTINCT STUDY_NUMBER FROM CTMS_REPORT WHERE VENDOR_NAME = ?", (vendor_name,))
-        study_numbers = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        return study_numbers
-
-    def get_country_names(self, vendor_name, study_number):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT DISTINCT SITE_NUMBER_WITHIN_STUDY 
-            FROM CTMS_REPORT 
-            WHERE VENDOR_NAME = ? AND STUDY_NUMBER = ? AND SAP_REGULATORY_BLOCK != 'Block Removed'
-        """, (vendor_name, study_number))
-        site_numbers = [row[0] for row in cursor.fetchall()]
-        conn.close()
-        return site_numbers
-
     def get_site_details(self, vendor_name, study_number, site_number):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT SIP_PLANNED_DATE, DEVODS_SITE_EXISTS, DEVODS_DATA_COMPLETE, SAP_SITE_CREATED, SAP_REGULATORY_BLOCK, ADDITIONAL_DETAILS
-            FROM CTMS_REPORT
-            WHERE VENDOR_NAME = ? AND STUDY_NUMBER = ? AND SITE_NUMBER_WITHIN_STUDY = ?
-        """, (vendor_name, study_number, site_number))
-        result = cursor.fetchone()
-        conn.close()
+        # Missing values are shown as blanks rather than being reported as 'No'
+        with self._lock:
+            cursor = self._conn.execute("""
+                SELECT COALESCE(SIP_PLANNED_DATE, ''), COALESCE(DEVODS_SITE_EXISTS, ''), COALESCE(DEVODS_DATA_COMPLETE, ''),
+                       COALESCE(SAP_SITE_CREATED, ''), COALESCE(SAP_REGULATORY_BLOCK, ''), COALESCE(ADDITIONAL_DETAILS, '')
+                FROM CTMS_REPORT
+                WHERE VENDOR_NAME = ? AND STUDY_NUMBER = ? AND SITE_NUMBER_WITHIN_STUDY = ?
+            """, (vendor_name, study_number, site_number))
+            result = cursor.fetchone()
         if result:
-            sip_planned_date, devods_site_exists, devods_data_complete, sap_site_created, sap_regulatory_block, additional_details = result
-            devods_site_exists = 'Yes' if devods_site_exists == 'Yes' else 'No'
-            devods_data_complete = 'Yes' if devods_data_complete == 'Yes' else 'No'
-            sap_site_created = 'Yes' if sap_site_created == 'Yes' else 'No'
-            return [sip_planned_date, devods_site_exists, devods_data_complete, sap_site_created, sap_regulatory_block, additional_details]
+            return list(result)
         else:
             return ["", "", "", "", "", ""]
 
-    def get_dashboard_data(self, vendor_name=None, study_number=None, site_number=None, output_variable=None):
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-        query = f"""
-            SELECT 
-                SUM(CASE WHEN {output_variable} = 'Yes' THEN 1 ELSE 0 END) AS yes_count,
-                SUM(CASE WHEN {output_variable} = 'No' THEN 1 ELSE 0 END) AS no_count,
-                SUM(CASE WHEN {output_variable} IS NULL THEN 1 ELSE 0 END) AS absent_count
-            FROM CTMS_REPORT
-            WHERE 1=1
-        """
-        params = []
-        if vendor_name:
-            query += " AND VENDOR_NAME = ?"
-            params.append(vendor_name)
-        if study_number:
-            query += " AND STUDY_NUMBER = ?"
-            params.append(study_number)
-        if site_number:
-            query += " AND SITE_NUMBER_WITHIN_STUDY = ?"
-            params.append(site_number)
-        cursor.execute(query, params)
-        result = cursor.fetchone()
-        conn.close()
-        return result
+    def _query_dashboard_all(self, vendor_name=None, study_number=None, site_number=None):
+        mask = (bool(vendor_name) << 2) | (bool(study_number) << 1) | bool(site_number)
+        params = tuple(value for value in (vendor_name, study_number, site_number) if value)
+        with self._lock:
+            result = self._conn.execute(self._dash_sql[mask], params).fetchone()
+        # Fan the flat row back out into one (yes, no, absent) triple per column
+        return {column: tuple(result[i * 3:i * 3 + 3]) for i, column in enumerate(self._dash_columns)}
 
 # Initialize components
-connector = OutlookConnector()
-extractor = AttachmentExtractor(connector, files_folder, ATTACHMENT_SUBJECTS)
-inserter = DataInserter(root_folder, files_folder)
+# Microsoft Graph is used when an app registration is configured, otherwise
+# attachments are read through the local Outlook client
+graph_client_id = os.getenv('GRAPH_CLIENT_ID')
+graph_tenant_id = os.getenv('GRAPH_TENANT_ID')
+if graph_client_id and graph_tenant_id:
+    connector = GraphConnector(graph_client_id, graph_tenant_id)
+    extractor = GraphAttachmentExtractor(connector, files_folder, ATTACHMENT_SUBJECTS)
+else:
+    connector = OutlookConnector()
+    extractor = AttachmentExtractor(connector, files_folder, ATTACHMENT_SUBJECTS)
 db_accessor = DatabaseAccessor(root_folder + "db\\cro_analysis.db")
+inserter = DataInserter(root_folder, files_folder, db_accessor, charts_folder)
 
 # Call the functions once before launching the Gradio app
 extractor.extract()
@@ -179,35 +424,77 @@ inserter.check_and_execute()
 
 vendor_names = db_accessor.get_vendor_names()
 
-OUTPUT_VARIABLE_MAP = {
-    "Site in DevODS": "DEVODS_SITE_EXISTS",
-    "Data in DevODS": "DEVODS_DATA_COMPLETE",
-    "Site in SAP": "SAP_SITE_CREATED",
-    "Reg. Block": "SAP_REGULATORY_BLOCK"
-}
+# Dropdown cascades for both panes are served from the preloaded hierarchy
+def update_study_choices(vendor_name):
+    return gr.update(choices=list(db_accessor.hierarchy.get(vendor_name, {})))
+
+def update_site_choices(vendor_name, study_number):
+    return gr.update(choices=db_accessor.hierarchy.get(vendor_name, {}).get(study_number, []))
+
+def render_pie_svg(path, title, yes, no, absent):
+    """Writes a three-slice pie chart as a standalone SVG file."""
+    width, height, cx, cy, r = 480, 400, 240, 215, 150
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" viewBox="0 0 {width} {height}" font-family="sans-serif">',
+        f'<text x="{cx}" y="30" text-anchor="middle" font-size="18">{escape(title)}</text>',
+    ]
+    sizes = (yes, no, absent)
+    total = sum(sizes)
+    if total <= 0:
+        parts.append(f'<text x="{cx}" y="{cy}" text-anchor="middle" font-size="14">No data available</text>')
+    else:
+        # Slices start at 12 o'clock and run counter-clockwise, like matplotlib's startangle=90
+        start = math.pi / 2
+        for label, color, size in zip(PIE_LABELS, PIE_COLORS, sizes):
+            if size <= 0:
+                continue
+            fraction = size / total
+            end = start + 2 * math.pi * fraction
+            if fraction >= 1:
+                parts.append(f'<circle cx="{cx}" cy="{cy}" r="{r}" fill="{color}"/>')
+            else:
+                x1, y1 = cx + r * math.cos(start), cy - r * math.sin(start)
+                x2, y2 = cx + r * math.cos(end), cy - r * math.sin(end)
+                large_arc = 1 if fraction > 0.5 else 0
+                parts.append(
+                    f'<path d="M{cx},{cy} L{x1:.2f},{y1:.2f} A{r},{r} 0 {large_arc} 0 {x2:.2f},{y2:.2f} Z" fill="{color}"/>'
+                )
+            middle = (start + end) / 2
+            parts.append(
+                f'<text x="{cx + 0.6 * r * math.cos(middle):.2f}" y="{cy - 0.6 * r * math.sin(middle):.2f}" '
+                f'text-anchor="middle" dominant-baseline="middle" font-size="13">{fraction * 100:.1f}%</text>'
+            )
+            parts.append(
+                f'<text x="{cx + 1.15 * r * math.cos(middle):.2f}" y="{cy - 1.15 * r * math.sin(middle):.2f}" '
+                f'text-anchor="middle" dominant-baseline="middle" font-size="14">{label}</text>'
+            )
+            start = end
+    parts.append('</svg>')
+    with open(path, "w", encoding="utf-8") as file:
+        file.write("\n".join(parts))
+
+def _pie_cache_key(vendor_name, study_number, site_number, output_variable, sizes):
+    """Short digest of everything that affects a rendered pie chart."""
+    key = repr((vendor_name, study_number, site_number, output_variable, *sizes))
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=8).hexdigest()
 
 def generate_pie_charts(vendor_name=None, study_number=None, site_number=None, output_variables=None):
     figs = []
     if not output_variables:
         return []
+    dashboard_data = db_accessor.get_dashboard_all(vendor_name, study_number, site_number)
+    os.makedirs(charts_folder, exist_ok=True)
     for output_variable in output_variables:
         db_column = OUTPUT_VARIABLE_MAP.get(output_variable)
         if not db_column:
             continue
-        data = db_accessor.get_dashboard_data(vendor_name, study_number, site_number, db_column)
-        labels = ['Yes', 'No', 'Absent']
+        data = dashboard_data[db_column]
         sizes = [data[0] or 0, data[1] or 0, data[2] or 0]
-        fig, ax = plt.subplots()
-        if sum(sizes) > 0:
-            ax.pie(sizes, labels=labels, autopct='%1.1f%%', startangle=90)
-            ax.axis('equal')  # Equal aspect ratio ensures that pie is drawn as a circle.
-        else:
-            ax.text(0.5, 0.5, "No data available", ha="center", va="center")
-            ax.axis('off')
-        ax.set_title(output_variable)
-        fig_path = os.path.join(files_folder, f"{output_variable}.png")
-        fig.savefig(fig_path)
-        plt.close(fig)
+        # Identical filters and counts render an identical chart, so reuse it
+        cache_key = _pie_cache_key(vendor_name, study_number, site_number, output_variable, sizes)
+        fig_path = os.path.join(charts_folder, f"{output_variable}_{cache_key}.svg")
+        if not os.path.exists(fig_path):
+            render_pie_svg(fig_path, output_variable, *sizes)
         figs.append(fig_path)
     return figs
 
@@ -217,8 +504,8 @@ with gr.Blocks() as demo:
         study_number_dropdown = gr.Dropdown(label="Select Study Number", choices=[])
         site_number_dropdown = gr.Dropdown(label="Select Site Number", choices=[])
     
-    vendor_name_dropdown.change(fn=lambda vendor_name: gr.update(choices=db_accessor.get_study_numbers(vendor_name)), inputs=vendor_name_dropdown, outputs=study_number_dropdown)
-    study_number_dropdown.change(fn=lambda vendor_name, study_number: gr.update(choices=db_accessor.get_site_numbers(vendor_name, study_number)), inputs=[vendor_name_dropdown, study_number_dropdown], outputs=site_number_dropdown)
+    vendor_name_dropdown.change(fn=update_study_choices, inputs=vendor_name_dropdown, outputs=study_number_dropdown)
+    study_number_dropdown.change(fn=update_site_choices, inputs=[vendor_name_dropdown, study_number_dropdown], outputs=site_number_dropdown)
     
     with gr.Row():
         sip_planned_date = gr.Textbox(label="SIP Planned Date", interactive=False)
@@ -247,8 +534,8 @@ with gr.Blocks() as demo:
             gr.Markdown("## Dashboard")
             pie_charts = gr.Gallery()
 
-    report_vendor_name.change(fn=lambda vendor_name: gr.update(choices=db_accessor.get_study_numbers(vendor_name)), inputs=report_vendor_name, outputs=report_study_number)
-    report_study_number.change(fn=lambda vendor_name, study_number: gr.update(choices=db_accessor.get_site_numbers(vendor_name, study_number)), inputs=[report_vendor_name, report_study_number], outputs=report_site_number)
+    report_vendor_name.change(fn=update_study_choices, inputs=report_vendor_name, outputs=report_study_number)
+    report_study_number.change(fn=update_site_choices, inputs=[report_vendor_name, report_study_number], outputs=report_site_number)
     report_button.click(fn=generate_pie_charts, inputs=[report_vendor_name, report_study_number, report_site_number, output_variables], outputs=pie_charts)
 
 demo.launch()
@@ -3,8 +3,17 @@ import sqlite3
 root_folder = "C:/Users/psharmak/OneDrive/psharmak_agents/CRO_file_analysis/"
 db_folder = root_folder + "db/"
 
+SQLITE_PRAGMAS = """
+    PRAGMA journal_mode=WAL;
+    PRAGMA synchronous=NORMAL;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-65536;
+    PRAGMA mmap_size=268435456;
+"""
+
 def drop_tables():
     conn = sqlite3.connect(db_folder + "cro_analysis.db")
+    conn.executescript(SQLITE_PRAGMAS)
     cursor = conn.cursor()
 
     # Drop ctms_report table
@@ -23,6 +32,7 @@ def drop_tables():
 
 def create_database():
     conn = sqlite3.connect(db_folder + "cro_analysis.db")
+    conn.executescript(SQLITE_PRAGMAS)
     cursor = conn.cursor()
 
     # Create ctms_report table
@@ -48,6 +58,20 @@ def create_database():
     """
     )
 
+    # Indexes for the dropdown cascades and dashboard filters
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_ctms_vendor_study_site
+        ON ctms_report (VENDOR_NAME, STUDY_NUMBER, SITE_NUMBER_WITHIN_STUDY)
+    """
+    )
+    cursor.execute(
+        """
+        CREATE INDEX IF NOT EXISTS idx_ctms_vendor_study_block
+        ON ctms_report (VENDOR_NAME, STUDY_NUMBER, SAP_REGULATORY_BLOCK)
+    """
+    )
+
     # Create ctms_devods_sap_cmp_report table
     cursor.execute(
         """
@@ -1,6 +1,9 @@
 import jaydebeapi
 import os
+import re
 import requests
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 
 # JDBC connection details
 jdbc_url = "jdbc:sftp:RemoteHost=sftp.amgen.com;"
@@ -13,6 +16,49 @@ password = os.getenv('DATABRICKS_PASSWORD')  # Use environment variable for secu
 output_folder = "C:\\Users\\psharmak\\OneDrive - Amgen\\psharmak\\agents\\CRO_file_analysis\\json_files"
 os.makedirs(output_folder, exist_ok=True)
 
+# Parallel downloads share one keep-alive connection pool
+MAX_WORKERS = 8
+CHUNK_SIZE = 1 << 16
+session = requests.Session()
+adapter = HTTPAdapter(pool_connections=16, pool_maxsize=16)
+session.mount("http://", adapter)
+session.mount("https://", adapter)
+
+# Feeds whose latest JSON file should be downloaded
+FILE_PREFIXES = (
+    "FTA_CTMS",
+    "FTA_STUDY",
+    "ICN_CTMS",
+    "ICN_STUDY",
+    "PPD_CTMS",
+    "PPD_STUDY",
+    "PXL_CTMS",
+    "PXL_STUDY",
+)
+DIGITS_RE = re.compile(r"\d")
+
+def select_latest_files(rows):
+    """
+    Returns the paths of the most recently modified file for each filename once
+    its digits (dates, sequence numbers) are stripped, limited to FILE_PREFIXES.
+    """
+    latest = {}
+    for file_path, file_name, last_modified in rows:
+        cleaned_name = DIGITS_RE.sub("", file_name)
+        current = latest.get(cleaned_name)
+        if current is None or last_modified > current[0]:
+            latest[cleaned_name] = (last_modified, [(file_path, file_name)])
+        elif last_modified == current[0]:
+            current[1].append((file_path, file_name))
+
+    file_paths = []
+    for _, files in latest.values():
+        for file_path, file_name in files:
+            upper_name = file_name.upper()
+            if upper_name.startswith(FILE_PREFIXES) and upper_name.endswith("JSON"):
+                file_paths.append(file_path)
+    return file_paths
+
 def run_query_and_get_file_paths():
     """
     Runs the SQL query via JDBC and returns the list of file paths.
@@ -27,58 +73,23 @@ def run_query_and_get_file_paths():
         )
         cursor = conn.cursor()
 
-        # Define the query
+        # Only list the JSON files; picking the latest version of each is done in
+        # Python, which avoids nesting ten REPLACE calls twice in the SQL
         query = """
-        WITH CleanedFiles AS (
-            SELECT
-                r.FilePath,
-                r.Filename,
-                r.LastModified,
-                REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(
-                    r.Filename, '1', ''), '2', ''), '3', ''), '4', ''), '5', ''), '6', ''), '7', ''), '8', ''), '9', ''), '0', '') AS CleanedFilename
-            FROM
-                "CData.SFTP.Root" r
-            WHERE
-                UPPER(r.Filename) LIKE '%.JSON'
-                AND UPPER(r.Filename) NOT LIKE '%TRANSFER%'
-        ),
-        LatestFiles AS (
-            SELECT
-                CleanedFilename,
-                MAX(LastModified) AS LastModified
-            FROM
-                CleanedFiles
-            GROUP BY
-                CleanedFilename
-        )
         SELECT
-            r.FilePath
+            r.FilePath,
+            r.Filename,
+            r.LastModified
         FROM
             "CData.SFTP.Root" r
-        JOIN
-            LatestFiles lf
-        ON
-            REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(REPLACE(
-                r.Filename, '1', ''), '2', ''), '3', ''), '4', ''), '5', ''), '6', ''), '7', ''), '8', ''), '9', ''), '0', '') = lf.CleanedFilename
-        AND r.LastModified = lf.LastModified
         WHERE
-            UPPER(r.Filename) LIKE 'FTA_CTMS%JSON'
-            OR UPPER(r.Filename) LIKE 'FTA_STUDY%JSON'
-            OR UPPER(r.Filename) LIKE 'ICN_CTMS%JSON'
-            OR UPPER(r.Filename) LIKE 'ICN_STUDY%JSON'
-            OR UPPER(r.Filename) LIKE 'PPD_CTMS%JSON'
-            OR UPPER(r.Filename) LIKE 'PPD_STUDY%JSON'
-            OR UPPER(r.Filename) LIKE 'PXL_CTMS%JSON'
-            OR UPPER(r.Filename) LIKE 'PXL_STUDY%JSON'
-            OR UPPER(r.Filename) LIKE 'PXL_STUDY_SITE%JSON'
-            OR UPPER(r.Filename) LIKE 'PXL_STUDY_SITE_ADDRESS%JSON'
-            OR UPPER(r.Filename) LIKE 'PXL_STUDY_SITE_PERSON%JSON'
-            OR UPPER(r.Filename) LIKE 'PXL_STUDY_SITE_WORKFORCE%JSON';
+            UPPER(r.Filename) LIKE '%.JSON'
+            AND UPPER(r.Filename) NOT LIKE '%TRANSFER%'
         """
 
         # Execute the query
         cursor.execute(query)
-        file_paths = [row[0] for row in cursor.fetchall()]
+        file_paths = select_latest_files(cursor.fetchall())
 
         # Close the connection
         conn.close()
@@ -88,14 +99,13 @@ def run_query_and_get_file_paths():
         print(f"Error running query: {e}")
         return []
 
-def download_json_files(file_paths):
+def download_json_file(file_path):
     """
-    Downloads JSON files from the given file paths and saves them to the output folder.
+    Downloads a single JSON file and streams it to the output folder.
     """
-    for file_path in file_paths:
-        try:
-            # Simulate downloading the file (replace this with actual logic if needed)
-            response = requests.get(file_path)
+    try:
+        # Simulate downloading the file (replace this with actual logic if needed)
+        with session.get(file_path, stream=True) as response:
             if response.status_code == 200:
                 # Extract the file name from the file path
                 file_name = os.path.basename(file_path)
@@ -103,13 +113,21 @@ def download_json_files(file_paths):
                 # Save the file to the output folder
                 output_file_path = os.path.join(output_folder, file_name)
                 with open(output_file_path, "wb") as output_file:
-                    output_file.write(response.content)
+                    for chunk in response.iter_content(CHUNK_SIZE):
+                        output_file.write(chunk)
 
                 print(f"Downloaded and saved: {file_name}")
             else:
                 print(f"Failed to download {file_path}: HTTP {response.status_code}")
-        except Exception as e:
-            print(f"Error downloading {file_path}: {e}")
+    except Exception as e:
+        print(f"Error downloading {file_path}: {e}")
+
+def download_json_files(file_paths):
+    """
+    Downloads JSON files from the given file paths and saves them to the output folder.
+    """
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
+        list(executor.map(download_json_file, file_paths))
 
 if __name__ == "__main__":
     # Run the query and get the file paths
@@ -1,6 +1,6 @@
 import sqlite3
-import csv
 import os
+import pandas as pd
 
 root_folder = "C:\\Users\\psharmak\\OneDrive - Amgen\\psharmak\\agents\\CRO_file_analysis\\"
 files_folder = os.path.join(root_folder, "files")
@@ -11,37 +11,64 @@ csv_files = {
     "CTMS_DEVODS_SAP_CMP_REPORT": "ctms_devods_sap_cmp_report.csv"
 }
 
+# Number of rows parsed by pandas and handed to executemany per batch
+CHUNK_SIZE = 50000
+# Read buffer for the CSV files, so large reports are read in 1 MiB blocks
+READ_BUFFER_SIZE = 1 << 20
+
 def insert_data_from_csv():
-    conn = sqlite3.connect(root_folder + "db\\cro_analysis.db")
+    conn = sqlite3.connect(root_folder + "db\\cro_analysis.db", isolation_level=None)
+    conn.executescript("""
+        PRAGMA journal_mode=WAL;
+        PRAGMA synchronous=NORMAL;
+        PRAGMA temp_store=MEMORY;
+        PRAGMA cache_size=-65536;
+        PRAGMA mmap_size=268435456;
+    """)
     cursor = conn.cursor()
+    try:
+        # A single explicit transaction so SQLite journals the whole load once
+        cursor.execute("BEGIN")
+
+        for table_name, csv_file in csv_files.items():
+            csv_path = os.path.join(files_folder, csv_file)
+            if not os.path.exists(csv_path):
+                print(f"{csv_file} not found. Skipping insertion into {table_name}.")
+                continue
+
+            record_count = 0
+            try:
+                header = pd.read_csv(csv_path, nrows=0, index_col=False).columns
+            except pd.errors.EmptyDataError:
+                header = []
+            table_columns = cursor.execute(f"PRAGMA table_info({table_name})").fetchall()
+            if len(header) != len(table_columns):
+                print(f"{csv_file} has {len(header)} columns but {table_name} has {len(table_columns)}. Skipping insertion into {table_name}.")
+                continue
+
+            # Truncate the table
+            cursor.execute(f"DELETE FROM {table_name}")
+
+            # Insert data into the table
+            placeholders = ', '.join(['?'] * len(header))
+            insert_sql = f"INSERT INTO {table_name} VALUES ({placeholders})"
+            with open(csv_path, 'r', encoding='utf-8', newline='', buffering=READ_BUFFER_SIZE) as file:
+                # Keep every value as the raw string, exactly as the csv module did
+                for chunk in pd.read_csv(file, chunksize=CHUNK_SIZE, dtype=str, na_filter=False, index_col=False):
+                    cursor.executemany(insert_sql, chunk.itertuples(index=False, name=None))
+                    record_count += len(chunk)
+
+            # Print the number of records inserted into the table
+            print(f"Number of records inserted into {table_name}: {record_count}")
 
-    for table_name, csv_file in csv_files.items():
-        csv_path = os.path.join(files_folder, csv_file)
-        if not os.path.exists(csv_path):
-            print(f"{csv_file} not found. Skipping insertion into {table_name}.")
-            continue
-
-        # Truncate the table
-        cursor.execute(f"DELETE FROM {table_name}")
-
-        # Insert data into the table
-        record_count = 0
-        try:
-            with open(csv_path, 'r', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                for row in reader:
-                    values = [row[column] for column in reader.fieldnames]
-                    placeholders = ', '.join(['?'] * len(values))
-                    cursor.execute(f"INSERT INTO {table_name} VALUES ({placeholders})", values)
-                    record_count += 1
-        except FileNotFoundError:
-            print(f"{csv_file} not found. Skipping insertion into {table_name}.")
-
-        # Print the number of records inserted into the table
-        print(f"Number of records inserted into {table_name}: {record_count}")
-
-    conn.commit()
-    conn.close()
+        cursor.execute("COMMIT")
+        # Refresh planner statistics so the ctms_report indexes are used
+        cursor.execute("ANALYZE")
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
 
 if __name__ == "__main__":
     insert_data_from_csv()
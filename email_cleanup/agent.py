@@ -1,14 +1,16 @@
 import win32com.client
 import re
-import json
+import orjson
 import logging
 import configparser
-from datetime import datetime
-from difflib import SequenceMatcher
+from datetime import date, datetime
+from rapidfuzz import fuzz
 import os
 from tabulate import tabulate
-import ast
 import sys
+import hashlib
+from collections import namedtuple
+import numpy as np
 
 # --- Configuration ---
 CONFIG_FILE = os.path.expanduser("C:\\Users\\psharmak\\OneDrive\\psharmak_agents\\email_cleanup\\config.ini")
@@ -26,6 +28,41 @@ BODY_SIMILARITY_THRESHOLD = config.getfloat('Thresholds', 'body_similarity')
 FIRST_300_CHARS_SIMILARITY_THRESHOLD = config.getfloat('Thresholds', 'first_300_chars_similarity')
 BODY_FILTERS = [filter.strip() for filter in config.get('Filters', 'body_filters').split('\n') if filter.strip()]
 
+# --- Normalization patterns ---
+# Timestamps and URLs need a regex; every other character is handled by one
+# str.translate pass through NORMALIZE_TABLE
+NOISE_RE = re.compile(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}|http\S+')
+
+class NormalizeTable(dict):
+    """str.translate table that lowercases ASCII letters, keeps digits and whitespace and drops the rest."""
+    def __missing__(self, code):
+        char = chr(code)
+        if char.isascii() and char.isalnum():
+            replacement = char.lower()
+        elif char.isspace():
+            replacement = char
+        else:
+            replacement = None
+        self[code] = replacement
+        return replacement
+
+NORMALIZE_TABLE = NormalizeTable()
+
+# --- Body signatures ---
+# Confirmed duplicates are remembered as 64-bit SimHashes of 5-character shingles
+SHINGLE_SIZE = 5
+SIMHASH_BITS = 64
+SIMHASH_MAX_DISTANCE = 3
+
+# --- Normalized bodies ---
+# The text plus everything the comparisons derive from it, computed once per body
+NormBody = namedtuple('NormBody', 'text length prefix hash prefix_hash')
+
+# --- Normalization cache ---
+# Normalized bodies keyed by a digest of the raw body, oldest entries evicted first
+NORMALIZE_CACHE_SIZE = 4096
+normalized_bodies = {}
+
 def connect_to_outlook():
     """Connects to Outlook and returns the inbox folder."""
     print("Connecting to Outlook...")
@@ -39,22 +76,38 @@ def connect_to_outlook():
         print(f"Failed to connect to Outlook: {e}")
         return None
 
+def make_norm_body(text):
+    """Bundles normalized text with its length, 300-character prefix and digests."""
+    prefix = text[:300]
+    return NormBody(text, len(text), prefix, body_digest(text), body_digest(prefix))
+
 def normalize_body(body):
     """Normalizes the email body for better comparison."""
     print("Normalizing body...")
     if not body:
-        return ""
+        return make_norm_body("")
     try:
-        body = re.sub(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}', '', body)  # Remove timestamps
-        body = re.sub(r'\s+', ' ', body)  # Normalize whitespace
-        body = re.sub(r'http\S+', '', body)  # Remove URLs
-        body = re.sub(r'[^a-zA-Z0-9\s]', '', body)  # Remove special characters
-        body = body.lower() # Convert to lowercase
-        body = re.sub(r'\b\w{1,2}\b', '', body) # Remove words that are 1 or 2 characters long
-        return body.strip()
+        body = NOISE_RE.sub('', body)  # Remove timestamps and URLs
+        body = body.translate(NORMALIZE_TABLE)  # Remove special characters and convert to lowercase
+        # Only ASCII letters, digits and whitespace are left, so words are exactly the split
+        # tokens: dropping 1-2 character words and rejoining also normalizes whitespace
+        return make_norm_body(' '.join(word for word in body.split() if len(word) > 2))
     except Exception as e:
         logging.error(f"Error normalizing body: {e}")
-        return ""
+        return make_norm_body("")
+
+def normalize_body_cached(body):
+    """Normalizes the email body, reusing the result for bodies already seen."""
+    if not body:
+        return normalize_body(body)
+    body_key = hashlib.blake2b(body.encode('utf-8', 'ignore'), digest_size=16).digest()
+    normalized_body = normalized_bodies.get(body_key)
+    if normalized_body is None:
+        normalized_body = normalize_body(body)
+        if len(normalized_bodies) >= NORMALIZE_CACHE_SIZE:
+            del normalized_bodies[next(iter(normalized_bodies))]
+        normalized_bodies[body_key] = normalized_body
+    return normalized_body
 
 def are_bodies_similar(body1, body2, threshold=BODY_SIMILARITY_THRESHOLD):
     """Checks if two email bodies are similar based on a threshold."""
@@ -62,27 +115,36 @@ def are_bodies_similar(body1, body2, threshold=BODY_SIMILARITY_THRESHOLD):
     if not body1 or not body2:
         return False, 0.0
     try:
-        similarity_ratio = SequenceMatcher(None, body1, body2).ratio()
+        similarity_ratio = fuzz.ratio(body1, body2) / 100.0
         return similarity_ratio > threshold, similarity_ratio
     except Exception as e:
         logging.error(f"Error comparing bodies: {e}")
         return False, 0.0
 
+def decode_key(key):
+    """Rebuilds a (subject, sender, date) key from its JSON array form."""
+    subject, sender, received_date = key
+    return (subject, sender, date.fromisoformat(received_date))
+
+def canonical_pair(key1, key2):
+    """Orders a pair of keys so (a, b) and (b, a) share one set/dict entry."""
+    return (key1, key2) if key1 <= key2 else (key2, key1)
+
 def load_learned_patterns():
     """Loads learned patterns from the JSON file."""
     print("Loading learned patterns...")
     try:
         if os.path.exists(LEARNED_PATTERNS_FILE):
-            with open(LEARNED_PATTERNS_FILE, 'r') as file:
-                patterns = json.load(file)
+            with open(LEARNED_PATTERNS_FILE, 'rb') as file:
+                patterns = orjson.loads(file.read())
                 return {
-                    'duplicates': {ast.literal_eval(key): value for key, value in patterns.get('duplicates', {}).items()},
-                    'non_duplicates': {ast.literal_eval(key): value for key, value in patterns.get('non_duplicates', {}).items()}
+                    'duplicates': {decode_key(key): signature for key, signature in patterns.get('duplicates', [])},
+                    'non_duplicates': {canonical_pair(decode_key(key1), decode_key(key2)): True for key1, key2 in patterns.get('non_duplicates', [])}
                 }
         else:
             logging.warning(f"Learned patterns file not found: {LEARNED_PATTERNS_FILE}. Starting with empty patterns.")
             return {'duplicates': {}, 'non_duplicates': {}}
-    except (json.JSONDecodeError, ValueError, SyntaxError) as e:
+    except ValueError as e:
         logging.error(f"Error decoding JSON file: {e}. Starting with empty patterns.")
         return {'duplicates': {}, 'non_duplicates': {}}
     except Exception as e:
@@ -93,168 +155,226 @@ def save_learned_patterns(patterns):
     """Saves learned patterns to the JSON file."""
     print("Saving learned patterns...")
     try:
-        with open(LEARNED_PATTERNS_FILE, 'w') as file:
-            patterns_str_keys = {
-                'duplicates': {str(key): value for key, value in patterns['duplicates'].items()},
-                'non_duplicates': {str(key): value for key, value in patterns['non_duplicates'].items()}
+        with open(LEARNED_PATTERNS_FILE, 'wb') as file:
+            # Keys are written as [subject, sender, date] arrays; orjson emits the
+            # date in ISO format
+            patterns_lists = {
+                'duplicates': [[key, signature] for key, signature in patterns['duplicates'].items()],
+                'non_duplicates': list(patterns['non_duplicates'])
             }
-            json.dump(patterns_str_keys, file, indent=4)
+            file.write(orjson.dumps(patterns_lists, option=orjson.OPT_INDENT_2))
         logging.info("Learned patterns saved successfully.")
     except Exception as e:
         logging.error(f"Error saving learned patterns: {e}")
 
+def body_digest(normalized_body):
+    """Returns a short digest used to spot identical normalized bodies in O(1)."""
+    return hashlib.blake2b(normalized_body.encode('utf-8'), digest_size=16).digest()
+
+def make_seen_entry(folder, key, entry_id, subject, sender, received_time, normalized_body=None):
+    """Builds the record kept for the last message seen with a given key.
+
+    The body is only filled in once another message with the same key shows up.
+    """
+    return {
+        'folder': folder.Name,
+        'entry_id': entry_id,
+        'subject': subject,
+        'sender': sender,
+        'received_time': received_time,
+        'body': normalized_body,
+        'key': key
+    }
+
+def simhash(normalized_body):
+    """Returns a 64-bit SimHash of the body's character shingles."""
+    shingle_hashes = b''.join(
+        hashlib.blake2b(normalized_body[start:start + SHINGLE_SIZE].encode('utf-8'), digest_size=SIMHASH_BITS // 8).digest()
+        for start in range(max(len(normalized_body) - SHINGLE_SIZE + 1, 1))
+    )
+    # Tally every bit position across all shingles at once: column k of the unpacked
+    # matrix is bit k of each big-endian shingle hash
+    hashes = np.frombuffer(shingle_hashes, dtype='>u8')
+    bits = np.unpackbits(hashes.astype('<u8').view(np.uint8).reshape(-1, SIMHASH_BITS // 8), axis=1, bitorder='little')
+    majority = 2 * bits.sum(axis=0, dtype=np.int64) > len(hashes)
+    return int.from_bytes(np.packbits(majority, bitorder='little').tobytes(), 'little')
+
+def is_learned_duplicate(learned_patterns, key, normalized_text):
+    """Checks if a body is within SimHash distance of a duplicate confirmed on an earlier run."""
+    if key not in learned_patterns['duplicates']:
+        return False
+    return bin(simhash(normalized_text) ^ learned_patterns['duplicates'][key]).count('1') <= SIMHASH_MAX_DISTANCE
+
+def load_seen_body(entry, namespace, store_id):
+    """Fetches and normalizes the body of a seen entry on first use."""
+    if entry['body'] is None:
+        entry['body'] = normalize_body_cached(namespace.GetItemFromID(entry['entry_id'], store_id).Body)
+
+def read_message_rows(folder):
+    """Yields (entry_id, subject, sender, received_time) for every item in a folder.
+
+    Metadata comes from a single Outlook Table instead of one COM round trip per
+    property per message.
+    """
+    table = folder.GetTable()
+    table.Columns.RemoveAll()
+    for column in ("EntryID", "Subject", "SenderName", "ReceivedTime"):
+        table.Columns.Add(column)
+    while not table.EndOfTable:
+        yield table.GetNextRow().GetValues()
+
 def find_and_remove_duplicates(folder, learned_patterns):
     """Finds and removes duplicate emails in a given folder."""
     print(f"Finding and removing duplicates in folder: {folder.Name}")
     try:
-        messages = folder.Items
+        namespace = folder.Session
+        store_id = folder.StoreID
         seen = {}
         duplicates = []
         compared_pairs = set()
 
-        message = messages.GetFirst()
-        while message:
-            key = (message.Subject, message.SenderName, message.ReceivedTime.date())
-            normalized_body = normalize_body(message.Body)
-            
-            if key in seen:
-                if (key, seen[key]['key']) in compared_pairs or (seen[key]['key'], key) in compared_pairs:
-                    message = messages.GetNext()
-                    continue
-
-                if (key, seen[key]['key']) in learned_patterns['non_duplicates'] or (seen[key]['key'], key) in learned_patterns['non_duplicates']:
-                    message = messages.GetNext()
-                    continue
-
-                similarity_ratio = SequenceMatcher(None, seen[key]['body'], normalized_body).ratio()
-                compared_pairs.add((key, seen[key]['key']))
-
-                if similarity_ratio == 1.0:
-                    duplicates.append(message)
-                    learned_patterns['duplicates'][key] = normalized_body
-                elif BODY_SIMILARITY_THRESHOLD <= similarity_ratio < 1.0:
-                    first_300_chars_similar, _ = are_bodies_similar(seen[key]['body'][:300], normalized_body[:300], threshold=FIRST_300_CHARS_SIMILARITY_THRESHOLD)
-                    if first_300_chars_similar:
+        # Pass 1 groups messages by (subject, sender, date) using Table metadata only.
+        # Duplicates always share a key, so pass 2 fetches and compares bodies for
+        # groups with more than one message and never touches unique keys. Within a
+        # group each message is only matched against the last body seen for the key,
+        # so the number of similarity computations stays linear in the folder size.
+        # The date is taken from each row's local ReceivedTime. Bulk-converting the column
+        # to numpy datetime64 would normalize pywintypes' timezone-aware values to UTC
+        # and move evening messages onto the next day's key.
+        groups = {}
+        for row in read_message_rows(folder):
+            groups.setdefault((row[1], row[2], row[3].date()), []).append(row)
+
+        for key, rows in groups.items():
+            if len(rows) < 2:
+                continue
+            for entry_id, subject, sender, received_time in rows:
+                if key in seen:
+                    if canonical_pair(key, seen[key]['key']) in compared_pairs:
+                        continue
+
+                    if canonical_pair(key, seen[key]['key']) in learned_patterns['non_duplicates']:
+                        continue
+
+                    load_seen_body(seen[key], namespace, store_id)
+                    message = namespace.GetItemFromID(entry_id, store_id)
+                    normalized_body = normalize_body_cached(message.Body)
+                    seen_body = seen[key]['body']
+
+                    seen_length, body_length = seen_body.length, normalized_body.length
+                    if seen_body.hash == normalized_body.hash:
+                        similarity_ratio = 1.0
+                    elif 2 * min(seen_length, body_length) / (seen_length + body_length) < BODY_SIMILARITY_THRESHOLD:
+                        # The ratio can never exceed 2*min/(len1+len2), so the lengths
+                        # alone rule out a near-duplicate
+                        similarity_ratio = 0.0
+                    elif seen_body.prefix_hash != normalized_body.prefix_hash and not are_bodies_similar(seen_body.prefix, normalized_body.prefix, threshold=FIRST_300_CHARS_SIMILARITY_THRESHOLD)[0]:
+                        # Bodies whose first 300 characters differ are never offered as
+                        # duplicates, so the full-body comparison can be skipped
+                        similarity_ratio = 0.0
+                    else:
+                        similarity_ratio = fuzz.ratio(seen_body.text, normalized_body.text) / 100.0
+                    compared_pairs.add(canonical_pair(key, seen[key]['key']))
+
+                    if similarity_ratio == 1.0:
+                        duplicates.append((entry_id, subject, sender, received_time))
+                        learned_patterns['duplicates'][key] = simhash(normalized_body.text)
+                    elif BODY_SIMILARITY_THRESHOLD <= similarity_ratio < 1.0 and is_learned_duplicate(learned_patterns, key, normalized_body.text):
+                        duplicates.append((entry_id, subject, sender, received_time))
+                    elif BODY_SIMILARITY_THRESHOLD <= similarity_ratio < 1.0:
                         table_data = [
                             ["", "Original Email", "Duplicate Email"],
                             ["Folder", seen[key]['folder'], folder.Name],
-                            ["Subject", seen[key]['subject'], message.Subject],
-                            ["Sender", seen[key]['sender'], message.SenderName],
-                            ["Received Time", seen[key]['received_time'], message.ReceivedTime],
+                            ["Subject", seen[key]['subject'], subject],
+                            ["Sender", seen[key]['sender'], sender],
+                            ["Received Time", seen[key]['received_time'], received_time],
                             ["Similarity", f"{similarity_ratio:.2f}", f"{similarity_ratio:.2f}"],
-                            ["First 300 characters", seen[key]['body'][:300], normalized_body[:300]]
+                            ["First 300 characters", seen_body.prefix, normalized_body.prefix]
                         ]
                         print(tabulate(table_data, headers="firstrow", tablefmt="grid"))
                         user_input = input("Delete duplicate email? (y/n): ")
                         if user_input.lower() == 'y':
-                            duplicates.append(message)
-                            learned_patterns['duplicates'][key] = normalized_body
+                            duplicates.append((entry_id, subject, sender, received_time))
+                            learned_patterns['duplicates'][key] = simhash(normalized_body.text)
                         else:
-                            learned_patterns['non_duplicates'][(key, seen[key]['key'])] = True
-                            seen[key] = {
-                                'folder': folder.Name,
-                                'subject': message.Subject,
-                                'sender': message.SenderName,
-                                'received_time': message.ReceivedTime,
-                                'body': normalized_body,
-                                'key': key
-                            }
+                            learned_patterns['non_duplicates'][canonical_pair(key, seen[key]['key'])] = True
+                            seen[key] = make_seen_entry(folder, key, entry_id, subject, sender, received_time, normalized_body)
                     else:
-                        learned_patterns['non_duplicates'][(key, seen[key]['key'])] = True
-                        seen[key] = {
-                            'folder': folder.Name,
-                            'subject': message.Subject,
-                            'sender': message.SenderName,
-                            'received_time': message.ReceivedTime,
-                            'body': normalized_body,
-                            'key': key
-                        }
+                        learned_patterns['non_duplicates'][canonical_pair(key, seen[key]['key'])] = True
+                        seen[key] = make_seen_entry(folder, key, entry_id, subject, sender, received_time, normalized_body)
                 else:
-                    learned_patterns['non_duplicates'][(key, seen[key]['key'])] = True
-                    seen[key] = {
-                        'folder': folder.Name,
-                        'subject': message.Subject,
-                        'sender': message.SenderName,
-                        'received_time': message.ReceivedTime,
-                        'body': normalized_body,
-                        'key': key
-                    }
-            else:
-                seen[key] = {
-                    'folder': folder.Name,
-                    'subject': message.Subject,
-                    'sender': message.SenderName,
-                    'received_time': message.ReceivedTime,
-                    'body': normalized_body,
-                    'key': key
-                }
-            
-            message = messages.GetNext()
+                    seen[key] = make_seen_entry(folder, key, entry_id, subject, sender, received_time)
 
-        for duplicate in duplicates:
-            logging.info(f"Deleting duplicate found in folder '{folder.Name}': Subject='{duplicate.Subject}', Sender='{duplicate.SenderName}', ReceivedTime='{duplicate.ReceivedTime}'")
-            print(f"Deleting duplicate found in folder '{folder.Name}': Subject='{duplicate.Subject}', Sender='{duplicate.SenderName}', ReceivedTime='{duplicate.ReceivedTime}'")
-            duplicate.Delete()
+        # Duplicates are queued by EntryID with their Table metadata, so no MailItem
+        # stays open past its comparison and logging needs no further COM reads
+        for entry_id, subject, sender, received_time in duplicates:
+            logging.info(f"Deleting duplicate found in folder '{folder.Name}': Subject='{subject}', Sender='{sender}', ReceivedTime='{received_time}'")
+            print(f"Deleting duplicate found in folder '{folder.Name}': Subject='{subject}', Sender='{sender}', ReceivedTime='{received_time}'")
+            namespace.GetItemFromID(entry_id, store_id).Delete()
     except Exception as e:
         logging.error(f"Error in find_and_remove_duplicates: {e}")
 
+def read_filter_matches(folder, body_filter):
+    """Yields (entry_id, received_time) for every item whose body contains body_filter.
+
+    The store evaluates the DASL restriction, so bodies never cross the COM boundary.
+    """
+    escaped_filter = body_filter.replace("'", "''")
+    table = folder.GetTable(f"@SQL=\"urn:schemas:httpmail:textdescription\" LIKE '%{escaped_filter}%'")
+    table.Columns.RemoveAll()
+    for column in ("EntryID", "ReceivedTime"):
+        table.Columns.Add(column)
+    while not table.EndOfTable:
+        yield table.GetNextRow().GetValues()
+
 def retain_most_recent_emails(folder):
     """Retains only the most recent emails with specific body content."""
     print(f"Retaining most recent emails in folder: {folder.Name}")
+    # Without filters there is nothing to restrict on
+    if not BODY_FILTERS:
+        return
     try:
-        messages = folder.Items
-        most_recent_messages = {}
+        namespace = folder.Session
+        store_id = folder.StoreID
+        claimed_entry_ids = set()
         messages_to_delete = []
-        
-        message = messages.GetFirst()
-        while message:
-            message_body = message.Body
-            # Check if the email body contains any of the filter strings
-            body_matches_filter = False
-            for body_filter in BODY_FILTERS:
-                if body_filter.lower() in message_body.lower():
-                    body_matches_filter = True
-                    break  # Exit the loop if a match is found
-            
-            # Only process if the body matches a filter
-            if body_matches_filter:
-                for body_filter in BODY_FILTERS:
-                    if body_filter.lower() in message_body.lower():
-                        if body_filter not in most_recent_messages or message.ReceivedTime > most_recent_messages[body_filter].ReceivedTime:
-                            if body_filter in most_recent_messages:
-                                messages_to_delete.append(most_recent_messages[body_filter])
-                            most_recent_messages[body_filter] = message
-                        else:
-                            messages_to_delete.append(message)
-                        break  # Only one filter should match per email
-            message = messages.GetNext()
-
-        for message in messages_to_delete:
-            for body_filter in BODY_FILTERS:
-                if body_filter.lower() in message.Body.lower():
-                    logging.info(f"Deleting older message with body containing '{body_filter}' received on '{message.ReceivedTime}'")
-                    print(f"Deleting older message with body containing '{body_filter}' received on '{message.ReceivedTime}'")
-                    message.Delete()
-                    break
-
-        # Process subfolders
-        subfolders = folder.Folders
-        for subfolder in subfolders:
-            retain_most_recent_emails(subfolder)
+
+        # A message matching several filters belongs to the first one in BODY_FILTERS
+        for body_filter in BODY_FILTERS:
+            matches = [match for match in read_filter_matches(folder, body_filter) if match[0] not in claimed_entry_ids]
+            if not matches:
+                continue
+            claimed_entry_ids.update(entry_id for entry_id, _ in matches)
+            most_recent = max(matches, key=lambda match: match[1])
+            messages_to_delete.extend((match, body_filter) for match in matches if match is not most_recent)
+
+        for (entry_id, received_time), body_filter in messages_to_delete:
+            logging.info(f"Deleting older message with body containing '{body_filter}' received on '{received_time}'")
+            print(f"Deleting older message with body containing '{body_filter}' received on '{received_time}'")
+            namespace.GetItemFromID(entry_id, store_id).Delete()
     except Exception as e:
         logging.error(f"Error in retain_most_recent_emails: {e}")
 
 def process_folder(folder, learned_patterns):
     """Processes a folder and its subfolders."""
-    print(f"Processing folder: {folder.Name}")
-    try:
-        find_and_remove_duplicates(folder, learned_patterns)
+    # Walk the tree with an explicit stack so each folder is visited exactly once,
+    # in the same depth-first order as before
+    folders = []
+    pending = [folder]
+    while pending:
+        folder = pending.pop()
+        print(f"Processing folder: {folder.Name}")
+        try:
+            find_and_remove_duplicates(folder, learned_patterns)
+            folders.append(folder)
+            pending.extend(reversed(list(folder.Folders)))
+        except Exception as e:
+            logging.error(f"Error processing folder '{folder.Name}': {e}")
+
+    # The filter pass runs once the duplicate walk has finished every folder;
+    # it logs its own errors
+    for folder in folders:
         retain_most_recent_emails(folder)
-        subfolders = folder.Folders
-        for subfolder in subfolders:
-            process_folder(subfolder, learned_patterns)
-    except Exception as e:
-        logging.error(f"Error processing folder '{folder.Name}': {e}")
 
 def main():
     """Main function to run the email cleanup process."""
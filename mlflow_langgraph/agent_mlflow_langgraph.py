@@ -1,40 +1,87 @@
 import os
-import mlflow
 import numpy as np
 import requests
 import json
 from typing_extensions import TypedDict
 from typing import Dict, List, Optional
-from langgraph.graph import StateGraph, START, END
 from dataclasses import dataclass
 import webbrowser
 import tempfile
+import string
+import re
+import functools
+import copy
+import time
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 
 # ┌─ AlphaFold API Integration ─────────────────────────────────────────────────
+ALPHAFOLD_API_URL = "https://alphafold.ebi.ac.uk/api"
+ALPHAFOLD_FILES_URL = "https://alphafold.ebi.ac.uk/files"
+ALPHAFOLD_MODEL_VERSION = 4
+ALPHAFOLD_CACHE_DIR = Path.home() / ".cache" / "agents" / "alphafold"
+ALPHAFOLD_CACHE_TTL = float(os.getenv("ALPHAFOLD_CACHE_TTL", 7 * 24 * 3600))  # seconds
+
+# Shared session so repeated requests reuse keep-alive connections instead of new TLS handshakes
+HTTP_SESSION = requests.Session()
+HTTP_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+
+DISORDER_AA = frozenset('PQSTNKRH')  # Disorder-promoting amino acids
+HYDROPHOBIC_AA = frozenset('AILMFWYV')
+CHARGED_AA = frozenset('DEKR')
+
+def residue_lut(residues: frozenset) -> np.ndarray:
+    """256-entry lookup table flagging the given one-letter residue codes"""
+    lut = np.zeros(256, dtype=np.uint8)
+    lut[[ord(aa) for aa in residues]] = 1
+    return lut
+
+# One bit per residue class, so a single table gather classifies the whole sequence
+DISORDER_FLAG, HYDROPHOBIC_FLAG, CHARGED_FLAG = 1, 2, 4
+RESIDUE_FLAGS_LUT = (residue_lut(DISORDER_AA) * DISORDER_FLAG
+                     | residue_lut(HYDROPHOBIC_AA) * HYDROPHOBIC_FLAG
+                     | residue_lut(CHARGED_AA) * CHARGED_FLAG)
+
+# p53 and its MDM2 binding partner, with p53 pre-encoded for the residue lookup tables
+P53_SEQUENCE = "MEEPQSDPSVEPPLSQETFSDLWKLLPENNVLSPLPSQAMDDLMLSPDDIEQWFTEDPGPDEAPRMPEAAPPVAPAPAAPTPAAPAPAPSWPLSSSVPSQKTYQGSYGFRLGFLHSGTAKSVTCTYSPALNKMFCQLAKTCPVQLWVDSTPPPGTRVRAMAIYKQSQHMTEVVRRCPHHERCSDSDGLAPPQHLIRVEGNLRVEYLDDRNTFRHSVVVPYEPPEVGSDCTTIHYNYMCNSSCMGGMNRRPILTIITLEDSSGNLLGRNSFEVRVCACPGRDRRTEEENLRKKGEPHHELPPGSTKRALPNNTSSSPQPKKKPLDGEYFTLQIRGRERFEMFRELNEALELKDAQAGKEPGGSRAHSSHLKSKKGQSTSRHKKLMFKTEGPDSD"
+MDM2_SEQUENCE = "MCNTNMSVPTDGAVTTSQIPASEQETLVRPKPLLLKLLKSVGAQKDTYTMKEVLFYLGQYIMTKRLYDEKQQHIVYCSNDLLGDLFGVPSFSVKEHRKIYTMIYRNLVVVNQQESSDSGTSVSEN"
+P53_RESIDUES = np.frombuffer(P53_SEQUENCE.encode('ascii'), dtype=np.uint8)
+
 def analyze_protein_sequence(sequence: str) -> Dict:
     """Analyze protein sequence for folding characteristics (ColabFold-inspired)"""
-    if not sequence:
+    return analyze_protein_residues(np.frombuffer(sequence.encode('ascii'), dtype=np.uint8))
+
+def analyze_protein_residues(residues: np.ndarray) -> Dict:
+    """Analyze a uint8 array of one-letter residue codes for folding characteristics"""
+    if residues.size == 0:
         return {'length': 0, 'disorder_regions': [], 'druggability_score': 0.5}
     
-    # Simple disorder prediction
-    disorder_regions = []
+    flags = RESIDUE_FLAGS_LUT[residues]
+    
+    # Simple disorder prediction, scoring every window from prefix sums of the disorder mask
     window_size = 10
-    for i in range(0, len(sequence) - window_size, 5):
-        window = sequence[i:i+window_size]
-        disorder_aa = 'PQSTNKRH'  # Disorder-promoting amino acids
-        disorder_score = sum(1 for aa in window if aa in disorder_aa) / len(window)
-        if disorder_score > 0.6:
-            disorder_regions.append((i, i+window_size))
+    disorder_counts = np.concatenate(([0], np.cumsum(flags & DISORDER_FLAG, dtype=np.int64)))
+    disorder_scores = (disorder_counts[window_size:] - disorder_counts[:-window_size]) / window_size
+    
+    # Mark the residues covered by any disordered window (+1 where a window opens, -1 where
+    # it closes), then report one region per contiguous covered stretch
+    window_starts = np.flatnonzero(disorder_scores > 0.6)
+    coverage_delta = (np.bincount(window_starts, minlength=residues.size + 1)
+                      - np.bincount(window_starts + window_size, minlength=residues.size + 1))
+    covered = np.cumsum(coverage_delta[:-1]) > 0
+    edges = np.diff(covered.astype(np.int8), prepend=0, append=0)
+    region_starts = np.flatnonzero(edges == 1)
+    region_ends = np.flatnonzero(edges == -1)
+    disorder_regions = [(int(start), int(end)) for start, end in zip(region_starts, region_ends)]
     
     # Druggability assessment
-    hydrophobic_aa = 'AILMFWYV'
-    charged_aa = 'DEKR'
-    hydrophobic_ratio = sum(1 for aa in sequence if aa in hydrophobic_aa) / len(sequence)
-    charged_ratio = sum(1 for aa in sequence if aa in charged_aa) / len(sequence)
+    hydrophobic_ratio = int(np.count_nonzero(flags & HYDROPHOBIC_FLAG)) / residues.size
+    charged_ratio = int(np.count_nonzero(flags & CHARGED_FLAG)) / residues.size
     druggability_score = min(1.0, (hydrophobic_ratio * 2 + charged_ratio) * 0.8)
     
     return {
-        'length': len(sequence),
+        'length': int(residues.size),
         'disorder_regions': disorder_regions,
         'druggability_score': druggability_score
     }
@@ -78,21 +125,84 @@ def query_alphafold_server(sequences: List[str], job_name: str = "drug_discovery
             'binding_sites': [{'chain': 'A', 'residues': [175, 248, 273], 'confidence': 0.75}]
         }
 
+def alphafold_pdb_url(uniprot_id: str) -> str:
+    """Conventional AlphaFold DB model URL for a UniProt accession (no HTTP required)"""
+    return f"{ALPHAFOLD_FILES_URL}/AF-{uniprot_id}-F1-model_v{ALPHAFOLD_MODEL_VERSION}.pdb"
+
+def get_with_retry(url: str, attempts: int = 3, backoff: float = 1.0) -> requests.Response:
+    """GET a URL, retrying connection errors, 429 and 5xx responses with exponential backoff"""
+    for attempt in range(attempts):
+        try:
+            response = HTTP_SESSION.get(url, timeout=10)
+        except requests.RequestException:
+            if attempt == attempts - 1:
+                raise
+        else:
+            if (response.status_code != 429 and response.status_code < 500) or attempt == attempts - 1:
+                return response
+        time.sleep(backoff * 2 ** attempt)
+
+def disk_cached(cache_dir: Path, ttl: float):
+    """Cache a function of one string key as JSON under cache_dir, expiring after ttl seconds"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(key: str):
+            cache_path = cache_dir / f"{key}.json"
+            if cache_path.exists() and time.time() - cache_path.stat().st_mtime < ttl:
+                with open(cache_path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            result = func(key)
+            cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_suffix('.tmp')
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(result, f)
+            os.replace(tmp_path, cache_path)
+            return result
+        return wrapper
+    return decorator
+
+@functools.lru_cache(maxsize=128)
+@disk_cached(ALPHAFOLD_CACHE_DIR / "prediction", ALPHAFOLD_CACHE_TTL)
+def fetch_alphafold_prediction(uniprot_id: str) -> List[Dict]:
+    """Fetch the raw AlphaFold prediction payload (raises on failure, so only successes are cached)"""
+    response = get_with_retry(f"{ALPHAFOLD_API_URL}/prediction/{uniprot_id}")
+    if response.status_code != 200:
+        raise Exception(f"Prediction API failed: {response.status_code}")
+    return response.json()
+
+@functools.lru_cache(maxsize=128)
+@disk_cached(ALPHAFOLD_CACHE_DIR / "summary", ALPHAFOLD_CACHE_TTL)
+def fetch_uniprot_summary(uniprot_id: str) -> Dict:
+    """Fetch the raw UniProt summary payload (raises on failure, so only successes are cached)"""
+    response = get_with_retry(f"{ALPHAFOLD_API_URL}/uniprot/summary/{uniprot_id}.json")
+    if response.status_code != 200:
+        raise Exception(f"UniProt summary API failed: {response.status_code}")
+    return response.json()
+
+def fetch_alphafold_entry(uniprot_id: str) -> Dict:
+    """Fetch the AlphaFold prediction and UniProt summary payloads (raises if the prediction is unavailable)"""
+    # The prediction and UniProt summary requests are independent, so overlap them
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        pred_future = executor.submit(fetch_alphafold_prediction, uniprot_id)
+        summary_future = executor.submit(fetch_uniprot_summary, uniprot_id)
+        pred_data = pred_future.result()
+        
+        # Prediction data is required, the UniProt summary is optional; a failed summary
+        # is left uncached so the next call retries it
+        try:
+            summary_data = summary_future.result()
+        except Exception as e:
+            print(f"UniProt summary unavailable for {uniprot_id}: {e}")
+            summary_data = {}
+    
+    return {'prediction': pred_data, 'summary': summary_data}
+
 def fetch_alphafold_data(uniprot_id: str) -> Dict:
     """Fetch protein data from AlphaFold API with sequence analysis"""
-    base_url = "https://alphafold.ebi.ac.uk/api"
-    
     try:
-        # Get prediction data
-        pred_response = requests.get(f"{base_url}/prediction/{uniprot_id}", timeout=10)
-        if pred_response.status_code != 200:
-            raise Exception(f"Prediction API failed: {pred_response.status_code}")
-        
-        pred_data = pred_response.json()
-        
-        # Get UniProt summary
-        summary_response = requests.get(f"{base_url}/uniprot/summary/{uniprot_id}.json", timeout=10)
-        summary_data = summary_response.json() if summary_response.status_code == 200 else {}
+        alphafold_entry = fetch_alphafold_entry(uniprot_id)
+        pred_data = alphafold_entry['prediction']
+        summary_data = alphafold_entry['summary']
         
         # Calculate average confidence from prediction data
         confidence = 0.85  # Default
@@ -102,12 +212,10 @@ def fetch_alphafold_data(uniprot_id: str) -> Dict:
                 confidence = entry['confidenceScore'] / 100.0
         
         # p53 sequence for analysis
-        p53_sequence = "MEEPQSDPSVEPPLSQETFSDLWKLLPENNVLSPLPSQAMDDLMLSPDDIEQWFTEDPGPDEAPRMPEAAPPVAPAPAAPTPAAPAPAPSWPLSSSVPSQKTYQGSYGFRLGFLHSGTAKSVTCTYSPALNKMFCQLAKTCPVQLWVDSTPPPGTRVRAMAIYKQSQHMTEVVRRCPHHERCSDSDGLAPPQHLIRVEGNLRVEYLDDRNTFRHSVVVPYEPPEVGSDCTTIHYNYMCNSSCMGGMNRRPILTIITLEDSSGNLLGRNSFEVRVCACPGRDRRTEEENLRKKGEPHHELPPGSTKRALPNNTSSSPQPKKKPLDGEYFTLQIRGRERFEMFRELNEALELKDAQAGKEPGGSRAHSSHLKSKKGQSTSRHKKLMFKTEGPDSD"
-        sequence_analysis = analyze_protein_sequence(p53_sequence)
+        sequence_analysis = analyze_protein_residues(P53_RESIDUES)
         
         # Query AlphaFold Server for enhanced structure prediction
-        mdm2_sequence = "MCNTNMSVPTDGAVTTSQIPASEQETLVRPKPLLLKLLKSVGAQKDTYTMKEVLFYLGQYIMTKRLYDEKQQHIVYCSNDLLGDLFGVPSFSVKEHRKIYTMIYRNLVVVNQQESSDSGTSVSEN"
-        af_server_result = query_alphafold_server([p53_sequence, mdm2_sequence], f"p53_mdm2_{uniprot_id}")
+        af_server_result = query_alphafold_server([P53_SEQUENCE, MDM2_SEQUENCE], f"p53_mdm2_{uniprot_id}")
         
         return {
             'uniprot_id': uniprot_id,
@@ -135,14 +243,16 @@ def fetch_alphafold_data(uniprot_id: str) -> Dict:
 # MLflow setup will be done in main function to avoid connection issues
 # └──────────────────────────────────────────────────────────────────────────────
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class ProteinTarget:
     uniprot_id: str
     name: str
     alphafold_confidence: float
     binding_sites: List[Dict]
+    pdb_url: str = ''
+    cif_url: str = ''
 
-@dataclass
+@dataclass(slots=True, frozen=True)
 class Compound:
     chembl_id: str
     smiles: str
@@ -150,6 +260,51 @@ class Compound:
     binding_affinity: float
     admet_score: float
 
+@dataclass(slots=True, frozen=True)
+class CompoundSet:
+    """Screened compounds stored column-wise so scoring runs over whole arrays
+
+    Scores carry about two meaningful digits, so the numeric columns are float32.
+    """
+    chembl_ids: np.ndarray
+    smiles: np.ndarray
+    molecular_weights: np.ndarray
+    binding_affinities: np.ndarray
+    admet_scores: np.ndarray
+
+    @classmethod
+    def from_records(cls, records: List[tuple]) -> 'CompoundSet':
+        """Build from (chembl_id, smiles, molecular_weight, binding_affinity, admet_score) tuples"""
+        chembl_ids, smiles, molecular_weights, binding_affinities, admet_scores = zip(*records) if records else ((),) * 5
+        return cls(
+            chembl_ids=np.array(chembl_ids, dtype=object),
+            smiles=np.array(smiles, dtype=object),
+            molecular_weights=np.array(molecular_weights, dtype=np.float32),
+            binding_affinities=np.array(binding_affinities, dtype=np.float32),
+            admet_scores=np.array(admet_scores, dtype=np.float32)
+        )
+
+    def __len__(self) -> int:
+        return len(self.chembl_ids)
+
+    def compound(self, index: int) -> Compound:
+        """Materialize a single row as a Compound"""
+        return Compound(
+            str(self.chembl_ids[index]),
+            str(self.smiles[index]),
+            float(self.molecular_weights[index]),
+            float(self.binding_affinities[index]),
+            float(self.admet_scores[index])
+        )
+
+    def head(self, count: int) -> List[Compound]:
+        """Materialize the first count rows as Compounds"""
+        return [self.compound(index) for index in range(min(count, len(self)))]
+
+    def lead_index(self) -> int:
+        """Index of the compound with the best binding affinity x ADMET score"""
+        return int(np.argmax(self.binding_affinities * self.admet_scores))
+
 class RareDiseaseState(TypedDict):
     # Disease Context
     disease_name: str
@@ -162,7 +317,7 @@ class RareDiseaseState(TypedDict):
     genetic_variants: List[str]
     
     # Drug Candidates
-    compounds: List[Compound]
+    compounds: CompoundSet
     lead_compound: Optional[Compound]
     
     # Trial Simulation Results
@@ -171,6 +326,7 @@ class RareDiseaseState(TypedDict):
     trial_success_probability: float
     recommended_for_trial: bool
 
+@functools.lru_cache(maxsize=8)
 def build_drug_discovery_agent(efficacy_threshold: float = 0.7):
     """
     Drug Discovery Pipeline:
@@ -204,20 +360,23 @@ def build_drug_discovery_agent(efficacy_threshold: float = 0.7):
             uniprot_id=alphafold_data['uniprot_id'],
             name=alphafold_data['name'],
             alphafold_confidence=alphafold_data['confidence'],
-            binding_sites=enhanced_sites
+            binding_sites=enhanced_sites,
+            pdb_url=alphafold_data.get('pdb_url', ''),
+            cif_url=alphafold_data.get('cif_url', '')
         )
         state['target_protein'] = target
         return state
 
     def screen_compounds(state: RareDiseaseState) -> RareDiseaseState:
         # Simulate ChEMBL compound screening
-        compounds = [
-            Compound("CHEMBL123", "CC(C)CC1=CC=C(C=C1)C(C)C(=O)O", 206.28, 8.5, 0.68),
-            Compound("CHEMBL456", "CC1=CC=C(C=C1)C(=O)NC2=CC=CC=C2", 211.26, 7.8, 0.74),
-            Compound("CHEMBL789", "COC1=CC=C(C=C1)C=CC(=O)O", 178.19, 6.9, 0.81)
-        ]
+        compounds = CompoundSet.from_records([
+            ("CHEMBL123", "CC(C)CC1=CC=C(C=C1)C(C)C(=O)O", 206.28, 8.5, 0.68),
+            ("CHEMBL456", "CC1=CC=C(C=C1)C(=O)NC2=CC=CC=C2", 211.26, 7.8, 0.74),
+            ("CHEMBL789", "COC1=CC=C(C=C1)C=CC(=O)O", 178.19, 6.9, 0.81)
+        ])
         state['compounds'] = compounds
-        state['lead_compound'] = max(compounds, key=lambda c: c.binding_affinity * c.admet_score)
+        # Only the lead is materialized as a Compound
+        state['lead_compound'] = compounds.compound(compounds.lead_index())
         return state
 
     def simulate_trial(state: RareDiseaseState) -> RareDiseaseState:
@@ -248,6 +407,9 @@ def build_drug_discovery_agent(efficacy_threshold: float = 0.7):
         state['recommended_for_trial'] = state['trial_success_probability'] >= efficacy_threshold
         return state
 
+    # Deferred so importing this module for analysis or visualization skips the LangGraph stack
+    from langgraph.graph import StateGraph, START, END
+    
     graph = StateGraph(RareDiseaseState)
     graph.add_node("FetchProteinData", fetch_protein_data)
     graph.add_node("ScreenCompounds", screen_compounds)
@@ -261,161 +423,29 @@ def build_drug_discovery_agent(efficacy_threshold: float = 0.7):
     
     return graph.compile()
 
+# Initial agent state for the rare disease scenario; callers get a deep copy since nodes mutate it
+SCENARIO_TEMPLATE = {
+    'disease_name': 'Li-Fraumeni Syndrome',
+    'cohort_size': 500,
+    'age_range': (25, 65),
+    'genetic_variants': ['TP53_R175H', 'TP53_R248W', 'TP53_R273H'],
+    'patient_genotype': {'TP53': 'R175H/WT', 'MDM2': 'SNP309_T/G'},
+    'compounds': CompoundSet.from_records([]),
+    'lead_compound': None,
+    'efficacy_score': 0.0,
+    'safety_score': 0.0,
+    'trial_success_probability': 0.0,
+    'recommended_for_trial': False
+}
+
 def create_rare_disease_scenario() -> dict:
     """Generate rare disease drug discovery scenario"""
-    return {
-        'disease_name': 'Li-Fraumeni Syndrome',
-        'cohort_size': 500,
-        'age_range': (25, 65),
-        'genetic_variants': ['TP53_R175H', 'TP53_R248W', 'TP53_R273H'],
-        'patient_genotype': {'TP53': 'R175H/WT', 'MDM2': 'SNP309_T/G'},
-        'compounds': [],
-        'lead_compound': None,
-        'efficacy_score': 0.0,
-        'safety_score': 0.0,
-        'trial_success_probability': 0.0,
-        'recommended_for_trial': False
-    }
+    return copy.deepcopy(SCENARIO_TEMPLATE)
 
-def generate_3dmol_visualization(compounds: List[Compound], protein_target: ProteinTarget) -> str:
-    """Generate HTML with 3Dmol.js visualization of compounds and protein"""
-    
-    # Try to get real AlphaFold PDB data
-    alphafold_data = fetch_alphafold_data(protein_target.uniprot_id)
-    pdb_url = alphafold_data.get('pdb_url', '')
-    
-    compound_info_html = ""
-    for i, compound in enumerate(compounds[:3]):
-        compound_info_html += f"""
-        <div class="compound-info">
-            <h3>{compound.chembl_id}</h3>
-            <p><strong>SMILES:</strong> {compound.smiles}</p>
-            <p><strong>Binding Affinity:</strong> {compound.binding_affinity:.1f}</p>
-            <p><strong>ADMET Score:</strong> {compound.admet_score:.2f}</p>
-            <div id="viewer{i}" class="viewer"></div>
-        </div>
-        """
-    
-    html_content = f"""
-<!DOCTYPE html>
-<html>
-<head>
-    <title>Drug Discovery Visualization</title>
-    <script src="https://3Dmol.csb.pitt.edu/build/3Dmol-min.js"></script>
-    <style>
-        body {{ 
-            font-family: Arial, sans-serif; 
-            margin: 20px; 
-            background: #f9f9f9; 
-            position: relative;
-        }}
-        .viewer {{ 
-            width: 400px; 
-            height: 300px; 
-            margin: 10px auto; 
-            border: 2px solid #333; 
-            background: white;
-            position: relative;
-            display: block;
-        }}
-        .compound-info {{ 
-            margin: 15px auto; 
-            padding: 15px; 
-            background: white; 
-            border-radius: 8px; 
-            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
-            max-width: 450px;
-        }}
-        .status {{ 
-            padding: 10px; 
-            background: #e8f4fd; 
-            border-left: 4px solid #2196F3; 
-            margin: 10px 0; 
-        }}
-        .error {{ 
-            background: #ffebee; 
-            border-left-color: #f44336; 
-        }}
-    </style>
-</head>
-<body>
-    <h1>Drug Discovery Visualization - Li-Fraumeni Syndrome</h1>
-    
-    <div class="status" id="status">Loading 3Dmol.js library...</div>
-    
-    <h2>Target Protein: {protein_target.name}</h2>
-    <p><strong>UniProt ID:</strong> {protein_target.uniprot_id} | <strong>AlphaFold Confidence:</strong> {protein_target.alphafold_confidence:.2f}</p>
-    <div id="protein-viewer" class="viewer"></div>
-    
-    <h2>Lead Compounds</h2>
-    {compound_info_html}
-    
-    <script>
-        function updateStatus(message, isError = false) {{
-            const status = document.getElementById('status');
-            status.textContent = message;
-            status.className = isError ? 'status error' : 'status';
-        }}
-        
-        // Wait for DOM to be fully loaded
-        document.addEventListener('DOMContentLoaded', function() {{
-            // Check if 3Dmol is loaded
-            if (typeof $3Dmol === 'undefined') {{
-                updateStatus('3Dmol.js failed to load. Check internet connection.', true);
-                return;
-            }}
-            
-            updateStatus('3Dmol.js loaded successfully. Rendering molecules...');
-            
-            setTimeout(function() {{
-                try {{
-                    // Protein visualization with AlphaFold data
-                    const proteinViewer = $3Dmol.createViewer('protein-viewer');
-                    const alphafoldPdbUrl = '{pdb_url}';
-                    
-                    if (alphafoldPdbUrl && alphafoldPdbUrl.length > 0) {{
-                        // Load real AlphaFold structure
-                        fetch(alphafoldPdbUrl)
-                            .then(response => response.text())
-                            .then(pdbData => {{
-                                proteinViewer.addModel(pdbData, 'pdb');
-                                proteinViewer.setStyle({{}}, {{cartoon: {{colorscheme: 'ssJmol'}}}});
-                                proteinViewer.setBackgroundColor('white');
-                                proteinViewer.zoomTo();
-                                proteinViewer.render();
-                                updateStatus('Loaded real AlphaFold structure!');
-                            }})
-                            .catch(error => {{
-                                console.error('Failed to load AlphaFold structure:', error);
-                                // Fallback to demo structure
-                                loadDemoProtein();
-                            }});
-                    }} else {{
-                        loadDemoProtein();
-                    }}
-                    
-                    function loadDemoProtein() {{
-                        const pdbData = `ATOM      1  N   ALA A   1      -8.901   4.127  -0.555  1.00 11.99           N  
-ATOM      2  CA  ALA A   1      -8.608   3.135  -1.618  1.00 11.99           C  
-ATOM      3  C   ALA A   1      -7.221   2.458  -1.897  1.00 11.99           C  
-ATOM      4  O   ALA A   1      -6.632   2.674  -2.955  1.00 11.99           O  
-ATOM      5  CB  ALA A   1      -9.062   3.898  -2.849  1.00 11.99           C  
-ATOM      6  N   GLY A   2      -6.888   1.618  -0.932  1.00 11.99           N  
-ATOM      7  CA  GLY A   2      -5.618   0.849  -0.967  1.00 11.99           C  
-ATOM      8  C   GLY A   2      -4.509   1.433  -0.111  1.00 11.99           C  
-ATOM      9  O   GLY A   2      -4.277   1.093   1.049  1.00 11.99           O  
-END`;
-                        proteinViewer.addModel(pdbData, 'pdb');
-                        proteinViewer.setStyle({{}}, {{sphere: {{colorscheme: 'Jmol', radius: 0.8}}}});
-                        proteinViewer.setBackgroundColor('white');
-                        proteinViewer.zoomTo();
-                        proteinViewer.render();
-                        updateStatus('Loaded demo protein structure');
-                    }}
-                    
-                    // Compound visualizations using SDF format (3Dmol.js compatible)
-                    const compoundData = [
-                        {{
+# ┌─ 3Dmol.js Visualization Template ──────────────────────────────────────────
+# Demo SDF structures for the screened compounds, spliced into the page as a JS array
+COMPOUND_SDF_JS = """[
+                        {
                             id: 'CHEMBL123',
                             name: 'Ibuprofen-like',
                             sdf: `
@@ -450,8 +480,8 @@ END`;
   8 13  1  0  0  0  0
 M  END
 $$$$`
-                        }},
-                        {{
+                        },
+                        {
                             id: 'CHEMBL456',
                             name: 'Benzamide derivative',
                             sdf: `
@@ -489,8 +519,8 @@ $$$$`
   1 14  1  0  0  0  0
 M  END
 $$$$`
-                        }},
-                        {{
+                        },
+                        {
                             id: 'CHEMBL789',
                             name: 'Ferulic acid-like',
                             sdf: `
@@ -523,40 +553,196 @@ $$$$`
   5  9  1  0  0  0  0
 M  END
 $$$$`
-                        }}
-                    ];
+                        }
+                    ]"""
+
+# Leading indentation and blank lines carry nothing in the page; the fixed-column SDF
+# blocks in COMPOUND_SDF_JS are whitespace-sensitive, so it is substituted in unstripped
+INDENTATION_RE = re.compile(r'\n\s+')
+
+def strip_indentation(html: str) -> str:
+    """Drop leading whitespace and blank lines from generated HTML"""
+    return INDENTATION_RE.sub('\n', html).strip()
+
+# Page skeleton; only the $-placeholders change between runs
+VIZ_TEMPLATE = string.Template(strip_indentation("""
+<!DOCTYPE html>
+<html>
+<head>
+    <title>Drug Discovery Visualization</title>
+    <script src="https://3Dmol.csb.pitt.edu/build/3Dmol-min.js"></script>
+    <style>
+        body { 
+            font-family: Arial, sans-serif; 
+            margin: 20px; 
+            background: #f9f9f9; 
+            position: relative;
+        }
+        .viewer { 
+            width: 400px; 
+            height: 300px; 
+            margin: 10px auto; 
+            border: 2px solid #333; 
+            background: white;
+            position: relative;
+            display: block;
+        }
+        .compound-info { 
+            margin: 15px auto; 
+            padding: 15px; 
+            background: white; 
+            border-radius: 8px; 
+            box-shadow: 0 2px 4px rgba(0,0,0,0.1);
+            max-width: 450px;
+        }
+        .status { 
+            padding: 10px; 
+            background: #e8f4fd; 
+            border-left: 4px solid #2196F3; 
+            margin: 10px 0; 
+        }
+        .error { 
+            background: #ffebee; 
+            border-left-color: #f44336; 
+        }
+    </style>
+</head>
+<body>
+    <h1>Drug Discovery Visualization - Li-Fraumeni Syndrome</h1>
+    
+    <div class="status" id="status">Loading 3Dmol.js library...</div>
+    
+    <h2>Target Protein: $protein_name</h2>
+    <p><strong>UniProt ID:</strong> $uniprot_id | <strong>AlphaFold Confidence:</strong> $confidence</p>
+    <div id="protein-viewer" class="viewer"></div>
+    
+    <h2>Lead Compounds</h2>
+    $compound_info_html
+    
+    <script>
+        function updateStatus(message, isError = false) {
+            const status = document.getElementById('status');
+            status.textContent = message;
+            status.className = isError ? 'status error' : 'status';
+        }
+        
+        // Wait for DOM to be fully loaded
+        document.addEventListener('DOMContentLoaded', function() {
+            // Check if 3Dmol is loaded
+            if (typeof $$3Dmol === 'undefined') {
+                updateStatus('3Dmol.js failed to load. Check internet connection.', true);
+                return;
+            }
+            
+            updateStatus('3Dmol.js loaded successfully. Rendering molecules...');
+            
+            setTimeout(function() {
+                try {
+                    // Protein visualization with AlphaFold data
+                    const proteinViewer = $$3Dmol.createViewer('protein-viewer');
+                    const alphafoldPdbUrl = '$pdb_url';
+                    
+                    if (alphafoldPdbUrl && alphafoldPdbUrl.length > 0) {
+                        // Load real AlphaFold structure
+                        fetch(alphafoldPdbUrl)
+                            .then(response => response.text())
+                            .then(pdbData => {
+                                proteinViewer.addModel(pdbData, 'pdb');
+                                proteinViewer.setStyle({}, {cartoon: {colorscheme: 'ssJmol'}});
+                                proteinViewer.setBackgroundColor('white');
+                                proteinViewer.zoomTo();
+                                proteinViewer.render();
+                                updateStatus('Loaded real AlphaFold structure!');
+                            })
+                            .catch(error => {
+                                console.error('Failed to load AlphaFold structure:', error);
+                                // Fallback to demo structure
+                                loadDemoProtein();
+                            });
+                    } else {
+                        loadDemoProtein();
+                    }
+                    
+                    function loadDemoProtein() {
+                        const pdbData = `ATOM      1  N   ALA A   1      -8.901   4.127  -0.555  1.00 11.99           N  
+ATOM      2  CA  ALA A   1      -8.608   3.135  -1.618  1.00 11.99           C  
+ATOM      3  C   ALA A   1      -7.221   2.458  -1.897  1.00 11.99           C  
+ATOM      4  O   ALA A   1      -6.632   2.674  -2.955  1.00 11.99           O  
+ATOM      5  CB  ALA A   1      -9.062   3.898  -2.849  1.00 11.99           C  
+ATOM      6  N   GLY A   2      -6.888   1.618  -0.932  1.00 11.99           N  
+ATOM      7  CA  GLY A   2      -5.618   0.849  -0.967  1.00 11.99           C  
+ATOM      8  C   GLY A   2      -4.509   1.433  -0.111  1.00 11.99           C  
+ATOM      9  O   GLY A   2      -4.277   1.093   1.049  1.00 11.99           O  
+END`;
+                        proteinViewer.addModel(pdbData, 'pdb');
+                        proteinViewer.setStyle({}, {sphere: {colorscheme: 'Jmol', radius: 0.8}});
+                        proteinViewer.setBackgroundColor('white');
+                        proteinViewer.zoomTo();
+                        proteinViewer.render();
+                        updateStatus('Loaded demo protein structure');
+                    }
+                    
+                    // Compound visualizations using SDF format (3Dmol.js compatible)
+                    const compoundData = $compound_sdf_js;
                     
-                    compoundData.forEach((compound, i) => {{
-                        setTimeout(function() {{
-                            try {{
-                                const viewer = $3Dmol.createViewer(`viewer${{i}}`);
+                    compoundData.forEach((compound, i) => {
+                        setTimeout(function() {
+                            try {
+                                const viewer = $$3Dmol.createViewer(`viewer$${i}`);
                                 viewer.addModel(compound.sdf, 'sdf');
-                                viewer.setStyle({{}}, {{stick: {{colorscheme: 'Jmol', radius: 0.2}}}});
-                                viewer.addStyle({{}}, {{sphere: {{colorscheme: 'Jmol', radius: 0.3}}}});
+                                viewer.setStyle({}, {stick: {colorscheme: 'Jmol', radius: 0.2}});
+                                viewer.addStyle({}, {sphere: {colorscheme: 'Jmol', radius: 0.3}});
                                 viewer.setBackgroundColor('white');
                                 viewer.zoomTo();
                                 viewer.render();
-                                console.log(`Rendered ${{compound.id}}`);
-                            }} catch (e) {{
-                                console.error(`Error rendering ${{compound.id}}:`, e);
-                            }}
-                        }}, i * 800);
-                    }});
+                                console.log(`Rendered $${compound.id}`);
+                            } catch (e) {
+                                console.error(`Error rendering $${compound.id}:`, e);
+                            }
+                        }, i * 800);
+                    });
                     
-                    setTimeout(function() {{
+                    setTimeout(function() {
                         updateStatus('Molecular visualization complete!');
-                    }}, 4000);
+                    }, 4000);
                     
-                }} catch (error) {{
+                } catch (error) {
                     console.error('Visualization error:', error);
                     updateStatus('Error rendering molecules: ' + error.message, true);
-                }}
-            }}, 2000); // Wait 2 seconds for 3Dmol to fully initialize
-        }});
+                }
+            }, 2000); // Wait 2 seconds for 3Dmol to fully initialize
+        });
     </script>
 </body>
 </html>
-    """
+    """))
+# └──────────────────────────────────────────────────────────────────────────────
+
+def generate_3dmol_visualization(compounds: CompoundSet, protein_target: ProteinTarget) -> str:
+    """Generate HTML with 3Dmol.js visualization of compounds and protein"""
+    
+    # Real AlphaFold PDB data was fetched with the target; if the prediction API was
+    # unavailable fall back to the conventional file URL and let the browser try it
+    pdb_url = protein_target.pdb_url or alphafold_pdb_url(protein_target.uniprot_id)
+    
+    compound_info_html = strip_indentation("".join(f"""
+        <div class="compound-info">
+            <h3>{compound.chembl_id}</h3>
+            <p><strong>SMILES:</strong> {compound.smiles}</p>
+            <p><strong>Binding Affinity:</strong> {compound.binding_affinity:.1f}</p>
+            <p><strong>ADMET Score:</strong> {compound.admet_score:.2f}</p>
+            <div id="viewer{i}" class="viewer"></div>
+        </div>
+        """ for i, compound in enumerate(compounds.head(3))))
+    
+    html_content = VIZ_TEMPLATE.substitute(
+        protein_name=protein_target.name,
+        uniprot_id=protein_target.uniprot_id,
+        confidence=f"{protein_target.alphafold_confidence:.2f}",
+        pdb_url=pdb_url,
+        compound_info_html=compound_info_html,
+        compound_sdf_js=COMPOUND_SDF_JS
+    )
     
     return html_content
 
@@ -564,15 +750,20 @@ def main(scenario_data: Optional[dict] = None, threshold: float = 0.65, visualiz
     if scenario_data is None:
         scenario_data = create_rare_disease_scenario()
     
+    # Deferred so importing this module for analysis or visualization skips MLflow's import cost
+    import mlflow
+    
     mlflow.set_tracking_uri(os.getenv("MLFLOW_TRACKING_URI", "file:./mlruns"))
     mlflow.set_experiment("rare_disease_drug_discovery")
     
     app = build_drug_discovery_agent(efficacy_threshold=threshold)
 
     with mlflow.start_run(run_name="virtual_clinical_trial") as run:
-        mlflow.log_param("efficacy_threshold", threshold)
-        mlflow.log_param("disease", scenario_data['disease_name'])
-        mlflow.log_param("cohort_size", scenario_data['cohort_size'])
+        mlflow.log_params({
+            "efficacy_threshold": threshold,
+            "disease": scenario_data['disease_name'],
+            "cohort_size": scenario_data['cohort_size']
+        })
         
         initial_state = RareDiseaseState(**scenario_data)
         final_state = app.invoke(initial_state)
@@ -588,23 +779,29 @@ def main(scenario_data: Optional[dict] = None, threshold: float = 0.65, visualiz
         # Generate and save molecular visualization
         if visualize:
             html_content = generate_3dmol_visualization(final_state['compounds'], final_state['target_protein'])
-            viz_path = os.path.join(os.getcwd(), "molecular_visualization.html")
-            with open(viz_path, 'w', encoding='utf-8') as f:
-                f.write(html_content)
             
-            # Log visualization as MLflow artifact
-            mlflow.log_artifact(viz_path, "visualizations")
+            # Log visualization as MLflow artifact straight from memory
+            mlflow.log_text(html_content, "visualizations/molecular_visualization.html")
+            
+            # The browser still needs a file, so write one copy to the temp directory
+            fd, viz_path = tempfile.mkstemp(prefix="molecular_visualization_", suffix=".html")
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(html_content)
             print(f"\n3D Molecular visualization saved to: {viz_path}")
             print("Opening visualization in browser...")
             webbrowser.open(f"file://{viz_path}")
 
-        mlflow.log_metric("efficacy_score", final_state['efficacy_score'])
-        mlflow.log_metric("safety_score", final_state['safety_score'])
-        mlflow.log_metric("trial_success_probability", final_state['trial_success_probability'])
-        mlflow.log_metric("trial_ready", int(final_state['recommended_for_trial']))
+        mlflow.log_metrics({
+            "efficacy_score": final_state['efficacy_score'],
+            "safety_score": final_state['safety_score'],
+            "trial_success_probability": final_state['trial_success_probability'],
+            "trial_ready": int(final_state['recommended_for_trial'])
+        })
         
-        mlflow.set_tag("agent_type", "drug_discovery")
-        mlflow.set_tag("target_protein", final_state['target_protein'].uniprot_id)
+        mlflow.set_tags({
+            "agent_type": "drug_discovery",
+            "target_protein": final_state['target_protein'].uniprot_id
+        })
         recommendation = "PROCEED" if final_state['recommended_for_trial'] else "HALT"
         mlflow.log_param("trial_recommendation", recommendation)
 